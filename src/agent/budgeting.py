@@ -0,0 +1,79 @@
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+from council.llm import LLMBase, LLMMessage, LLMResult
+from council.runners import Budget, Consumption
+
+# All LLM token usage is recorded under this unit/kind, whatever the model, so that one limit covers it
+TOKEN_UNIT = "token"
+TOKEN_KIND = "llm"
+LATENCY_UNIT = "second"
+
+# Council stops waiting for a skill when the budget expires, so work started by a skill must end before that
+DEADLINE_MARGIN = 1.0
+
+
+class BudgetExhaustedException(Exception):
+    pass
+
+
+def turn_budget(duration: float, max_tokens: Optional[int] = None) -> Budget:
+    """Budget for one agent turn: wall-clock `duration` seconds and, optionally, `max_tokens` LLM tokens."""
+    limits = [Consumption(max_tokens, TOKEN_UNIT, TOKEN_KIND)] if max_tokens is not None else []
+    return Budget(duration, limits=limits)
+
+
+def remaining_tokens(budget: Budget) -> Optional[float]:
+    # `remaining()` shares the limits of the budget it comes from, so this is the turn-wide remainder
+    for limit in budget._remaining:
+        if limit.unit == TOKEN_UNIT and limit.kind == TOKEN_KIND:
+            return limit.value
+    return None
+
+
+def check_budget(budget: Budget, min_duration: float = 0):
+    """Raise if the budget is expired, out of tokens, or has less than `min_duration` seconds left."""
+    if budget.is_expired():
+        raise BudgetExhaustedException("the time or token budget for this request is exhausted")
+    if budget.remaining_duration < min_duration:
+        raise BudgetExhaustedException(
+            f"{budget.remaining_duration:.0f}s left in the budget for this request, {min_duration:.0f}s needed"
+        )
+
+
+def post_chat_request(llm: LLMBase, messages: List[LLMMessage], budget: Budget, source: str) -> LLMResult:
+    """
+    `llm.post_chat_request`, checked against the budget first, with the tokens and latency of the call
+    recorded against it.
+    """
+    check_budget(budget)
+    kwargs = {"deadline": budget.deadline} if getattr(llm, "accepts_deadline", False) else {}
+
+    start = time.monotonic()
+    result = llm.post_chat_request(messages, **kwargs)
+    tokens = sum(c.value for c in result.consumptions if c.unit == TOKEN_UNIT)
+    budget.add_consumption(Consumption(tokens, TOKEN_UNIT, TOKEN_KIND), source)
+    budget.add_consumption(Consumption(time.monotonic() - start, LATENCY_UNIT, TOKEN_KIND), source)
+    return result
+
+
+def usage_report(budget: Budget) -> dict:
+    """Tokens, LLM calls and LLM latency recorded against a budget, in total and per source."""
+    report = {"tokens": 0, "llm_calls": 0, "llm_seconds": 0.0, "by_source": defaultdict(lambda: defaultdict(float))}
+    for event in budget._consumptions:
+        consumption = event.consumption
+        if consumption.kind != TOKEN_KIND:
+            continue
+        by_source = report["by_source"][event.source]
+        if consumption.unit == TOKEN_UNIT:
+            report["tokens"] += consumption.value
+            by_source["tokens"] += consumption.value
+        elif consumption.unit == LATENCY_UNIT:
+            report["llm_calls"] += 1
+            report["llm_seconds"] += consumption.value
+            by_source["llm_calls"] += 1
+            by_source["llm_seconds"] += consumption.value
+    report["by_source"] = {source: dict(usage) for source, usage in report["by_source"].items()}
+    report["elapsed_seconds"] = budget.duration - budget.remaining_duration
+    return report
@@ -1,6 +1,13 @@
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import shutil
 import subprocess
-import sys
+import tempfile
+import time
+import uuid
 
 """
 Instructions to set up code sandbox.
@@ -8,41 +15,247 @@ Instructions to set up code sandbox.
 2. `python -m venv code_sandbox`
 3. `source code_sandbox/bin/activate`
 4. pip install pandas plotly
+
+Helpers in `sandbox_lib` (e.g. `fred_panel.get_panel`) are importable from the sandboxed code.
+
+The venv is shared by all sessions, and only read from: each session's code runs in a workspace of its own
+(see `WorkspacePool`), which is its working directory and TMPDIR. The pool makes the venv read-only when it
+starts (see `protect_interpreter`); to install more packages, `chmod -R u+w code_sandbox` first.
 """
 
-@contextmanager
-def sandbox_environment(sandbox_path):
-    # Save the original sys.path and sys.modules
-    original_sys_path = sys.path.copy()
-    original_sys_modules = sys.modules.copy()
+SANDBOX_LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_lib")
+
+def run_code_in_sandbox(code, sandbox_path, timeout=None, profile=False, workspace=None):
+    """
+    Run `code` with the sandbox's interpreter, in `workspace` if given (see `WorkspacePool.workspace`). With
+    `profile`, the code runs under `sandbox_lib/profile_runner` and the result also has a "profile" summary
+    (None if the run was stopped before it could be written).
+    """
+    command = [f"{sandbox_path}/python", "-c", code]
+    if profile:
+        fd, profile_path = tempfile.mkstemp(prefix="sandbox-profile-", suffix=".json")
+        os.close(fd)
+        command = [f"{sandbox_path}/python", "-m", "profile_runner", profile_path, code]
 
+    print("Starting execution...")
     try:
-        # Add the virtual environment path to sys.path
-        sys.path.insert(0, sandbox_path)
+        execution = subprocess.run(
+            command,
+            capture_output=True,
+            cwd=workspace,
+            env=sandbox_env(workspace),
+            timeout=timeout,
+        )
+        result = {
+            "code": code,
+            "returncode": execution.returncode,
+            "stdout": execution.stdout.decode(),
+            "stderr": execution.stderr.decode(),
+        }
+    except subprocess.TimeoutExpired as e:
+        result = {
+            "code": code,
+            "returncode": -1,
+            "stdout": (e.stdout or b"").decode(),
+            "stderr": f"Execution was stopped after {timeout:.0f} seconds, the time budget of this request.",
+        }
+
+    if profile:
+        result["profile"] = _read_profile(profile_path)
+    return result
+
+
+def protect_interpreter(sandbox_path):
+    """
+    Make the sandbox's venv read-only, so that no session's code can install packages into it or change the
+    files every other session runs. Raises if the interpreter is not a venv (its installation is not ours to
+    change) and the server's user can write to it. Permissions do not bind root, so running as root is only
+    warned about.
+    """
+    prefix = subprocess.run(
+        [f"{sandbox_path}/python", "-c", "import sys; print(sys.prefix)"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=sandbox_env(),
+    ).stdout.strip()
+    if not os.path.exists(os.path.join(prefix, "pyvenv.cfg")):
+        if os.access(prefix, os.W_OK):
+            raise RuntimeError(
+                f"the sandbox's interpreter ({prefix}) is writable by the server's user and is not a venv: "
+                "use a dedicated venv (see `code_sandbox.py`), or an interpreter the server cannot write to"
+            )
+        return
+
+    for directory, _, filenames in os.walk(prefix):
+        for path in [directory] + [os.path.join(directory, name) for name in filenames]:
+            # Links point out of the venv (e.g. to the base interpreter), which is not ours to change
+            if os.path.islink(path):
+                continue
+            mode = os.stat(path).st_mode
+            if mode & 0o222:
+                os.chmod(path, mode & ~0o222)
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        logging.getLogger("council").warning(
+            f"the server runs as root, which can still write to the sandbox's venv ({prefix}) and so can its code"
+        )
 
-        # - Disable filesystem access:
-        # sys.modules["os"] = None
 
-        # - Disable network access:
-        sys.modules["_socket"] = None
-        sys.modules["socket"] = None
-        sys.modules["urllib"] = None
+def sandbox_env(workspace=None):
+    """Environment of the sandbox's processes: `sandbox_lib` importable, and nothing written to the venv."""
+    env = os.environ | {"PYTHONPATH": SANDBOX_LIB_DIR, "PYTHONDONTWRITEBYTECODE": "1", "PYTHONNOUSERSITE": "1"}
+    if workspace is not None:
+        env["TMPDIR"] = os.path.join(workspace, "tmp")
+    return env
 
-        yield
 
+def _read_profile(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
     finally:
-        # Restore the original sys.path and sys.modules
-        sys.path = original_sys_path
-        sys.modules = original_sys_modules
+        os.remove(path)
 
 
-def run_code_in_sandbox(code, sandbox_path):
-    with sandbox_environment(sandbox_path):
-        print("Starting execution...")
-        execution = subprocess.run([f"{sandbox_path}/python", "-c", code], capture_output=True)
-        return {
-            "code": code,
-            "returncode": execution.returncode,
-            "stdout": execution.stdout.decode(),
-            "stderr": execution.stderr.decode(),
-        }
+def format_profile(profile, top=5):
+    """Short text version of a profile summary from `run_code_in_sandbox`, for users and prompts."""
+    if not profile:
+        return "None."
+    lines = [
+        f"Wall time {profile['wall_seconds']:.2f}s (CPU {profile['cpu_seconds']:.2f}s), "
+        f"network wait {profile['network']['wait_seconds']:.2f}s over {profile['network']['calls']} calls, "
+        f"peak traced memory {profile['peak_memory_bytes'] / 2**20:.1f} MB."
+    ]
+    if profile["lines"]:
+        lines.append("Slowest lines:")
+        lines += [
+            f"  line {h['line']}: {h['seconds']:.2f}s ({h['share']:.0%}) {h['source']}"
+            for h in profile["lines"][:top]
+        ]
+    if profile["functions"]:
+        lines.append("Slowest functions (own time, main thread):")
+        lines += [
+            f"  {h['function']}: {h['self_seconds']:.2f}s in {h['calls']} calls"
+            for h in profile["functions"][:top]
+        ]
+    return "\n".join(lines)
+
+
+def prefetch_series(series_ids, sandbox_path):
+    """
+    Start warming the sandbox's FRED series cache in a background process. Returns once the process has
+    marked the series it downloads as in flight, so that code run from then on waits for those downloads
+    instead of repeating them (see `fred_cache.SeriesCache.fetching`).
+    """
+    process = subprocess.Popen(
+        [f"{sandbox_path}/python", "-m", "fred_cache", *series_ids],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env=sandbox_env(),
+    )
+    with process.stdout:
+        # Empty if the process failed before marking anything
+        process.stdout.readline()
+    return process
+
+
+class WorkspacePool:
+    """
+    Workspaces of the sandboxed code: one directory per session, kept across the session's runs, so that
+    the files its scripts write neither clash with other sessions' files nor end up in the server's directory.
+
+    A few empty workspaces are kept ready, so a session's first run gets one with a rename, and released or
+    expired workspaces are deleted in the background. All the worker processes using the same `root` share the
+    workspaces; the runs of a session do not overlap, as they hold the session's lock.
+    """
+
+    def __init__(self, root, spares=4, max_age=24 * 3600, sandbox_path=None):
+        """
+        Parameters:
+            root (str): directory holding the workspaces
+            spares (int): number of empty workspaces kept ready
+            max_age (float): seconds of inactivity of a session (see `touch`) after which its workspace is deleted
+            sandbox_path (str): `bin` directory of the sandbox's venv, made read-only (see `protect_interpreter`)
+        """
+        if sandbox_path is not None:
+            protect_interpreter(sandbox_path)
+        self.root = root
+        self.spares = spares
+        self.max_age = max_age
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workspace-pool")
+        for name in ["spares", "sessions", "trash"]:
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+        self._executor.submit(self._maintain)
+
+    def _session_path(self, session_id):
+        return os.path.join(self.root, "sessions", hashlib.sha256(session_id.encode()).hexdigest()[:32])
+
+    @staticmethod
+    def _provision(path):
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+
+    def workspace(self, session_id):
+        """The session's workspace, taken from the spares on first use."""
+        path = self._session_path(session_id)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            spares_dir = os.path.join(self.root, "spares")
+            for name in os.listdir(spares_dir):
+                if name.startswith("."):
+                    continue
+                try:
+                    os.rename(os.path.join(spares_dir, name), path)
+                    os.utime(path)
+                    break
+                except OSError:
+                    # Taken by another thread or process meanwhile
+                    continue
+            self._executor.submit(self._maintain)
+        # Also recreates the workspace if `_maintain` expired it meanwhile
+        self._provision(path)
+        return path
+
+    def touch(self, session_id):
+        """Mark the session as active, so that its workspace does not expire (see `max_age`)."""
+        try:
+            os.utime(self._session_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def release(self, session_id):
+        """Delete the session's workspace, in the background."""
+        if self._discard(self._session_path(session_id)):
+            self._executor.submit(self._maintain)
+
+    def _discard(self, path):
+        try:
+            os.rename(path, os.path.join(self.root, "trash", uuid.uuid4().hex))
+            return True
+        except OSError:
+            return False
+
+    def _maintain(self):
+        sessions_dir = os.path.join(self.root, "sessions")
+        for name in os.listdir(sessions_dir):
+            path = os.path.join(sessions_dir, name)
+            try:
+                expired = os.path.getmtime(path) < time.time() - self.max_age
+            except OSError:
+                continue
+            if expired:
+                self._discard(path)
+
+        trash_dir = os.path.join(self.root, "trash")
+        for name in os.listdir(trash_dir):
+            shutil.rmtree(os.path.join(trash_dir, name), ignore_errors=True)
+
+        spares_dir = os.path.join(self.root, "spares")
+        ready = [name for name in os.listdir(spares_dir) if not name.startswith(".")]
+        for _ in range(self.spares - len(ready)):
+            # Built under a hidden name, so that it is only taken once complete
+            building = os.path.join(spares_dir, f".{uuid.uuid4().hex}")
+            self._provision(building)
+            os.rename(building, os.path.join(spares_dir, uuid.uuid4().hex))
@@ -1,6 +1,6 @@
 import logging
 from string import Template
-from typing import List, Tuple
+from typing import Any, List, Optional, Tuple
 
 from council.contexts import (
     AgentContext,
@@ -14,6 +14,9 @@ from council.utils import Option
 from council.runners import Budget
 from council.controllers import ControllerBase, ExecutionUnit
 
+from budgeting import BudgetExhaustedException, post_chat_request
+from session_store import BlobStore, digest, text_bytes
+
 logger = logging.getLogger("council")
 
 class LLMInstructController(ControllerBase):
@@ -29,6 +32,11 @@ class LLMInstructController(ControllerBase):
         hints: List[str] = "",
         response_threshold: float = 0,
         top_k_execution_plan: int = 10000,
+        blob_store: Optional[BlobStore] = None,
+        blob_threshold: int = 1024,
+        history_window: int = 10,
+        state: Optional[dict] = None,
+        run_data: Optional[dict] = None,
     ):
         """
         Initialize a new instance
@@ -38,24 +46,76 @@ class LLMInstructController(ControllerBase):
             hints (List(str)): Application-specific hints to pass to the LLM (e.g. ["If the user is asking for a recipe, always ask the 'Recipes' chain for something extra spicy."])
             response_threshold (float): a minimum threshold to select a response from its score
             top_k_execution_plan (int): maximum number of execution plan returned
+            blob_store (BlobStore): where state values longer than `blob_threshold` bytes are kept
+            blob_threshold (int): state values longer than this are stored by handle, and only digested in prompts
+            history_window (int): number of most recent conversation messages included in the prompt
+            state (dict): controller state to resume from, as left by a previous instance (see `state`)
+            run_data (dict): values passed to the chains along with the state, but neither kept in the state nor
+                shown to the LLM (e.g. the session id)
         """
         self._llm = llm
         self._hints = hints
         self._response_threshold = response_threshold
         self._top_k = top_k_execution_plan
+        self._blob_store = blob_store if blob_store is not None else BlobStore()
+        self._blob_threshold = blob_threshold
+        self._history_window = history_window
+
+        self._run_data = run_data or {}
 
         # Controller State
-        self._state = {
+        self._state = state if state is not None else {
             "iteration": 0
         }
 
+    @property
+    def blob_store(self) -> BlobStore:
+        return self._blob_store
+
+    @property
+    def state(self) -> dict:
+        """Raw state (large values by handle into `blob_store`), to persist along with the blob store."""
+        return self._state
+
+    def get_state(self, key: str, default: Any = None) -> Any:
+        """Value of a state entry, with large values resolved from the blob store."""
+        value = self._state.get(key, default)
+        if BlobStore.is_handle(value):
+            return self._blob_store.get(value)
+        return value
+
+    def set_state(self, key: str, value: Any):
+        """Set a state entry, moving large values into the blob store."""
+        if isinstance(value, str) and text_bytes(value) > self._blob_threshold:
+            # Blobs the rest of the state refers to must survive the eviction this may cause
+            referenced = [v for k, v in self._state.items() if k != key and BlobStore.is_handle(v)]
+            value = self._blob_store.put(value, referenced=referenced)
+        self._state[key] = value
+
+    def update_state(self, data: dict):
+        for key, value in data.items():
+            self.set_state(key, value)
+
+    def resolved_state(self) -> dict:
+        return {key: self.get_state(key) for key in self._state}
+
+    def prompt_state(self) -> dict:
+        # Structured values (e.g. an execution profile) are digested as text too
+        return {
+            key: digest(str(value) if isinstance(value, (dict, list)) else value)
+            for key, value in self.resolved_state().items()
+        }
+
     def get_plan(
         self, context: AgentContext, chains: List[Chain], budget: Budget
     ) -> List[ExecutionUnit]:
         chain_details = "\n ".join(
             [f"name: {c.name}, description: {c.description}" for c in chains]
         )
-        conversation_history = [f"{m.kind}: {m.message}" for m in context.chatHistory.messages]
+        chat_messages = list(context.chatHistory.messages)
+        conversation_history = [
+            f"{m.kind}: {digest(m.message, max_chars=1000)}" for m in chat_messages[-self._history_window:]
+        ]
 
         system_message = """
         You are the Controller module for an AI assistant. Your role is to control the execution flow by selecting and invoking chains with relevant instructions using natural language."""
@@ -91,9 +151,9 @@ class LLMInstructController(ControllerBase):
         main_prompt = main_prompt_template.substitute(
             chain_details=chain_details,
             hints='\n'.join(self._hints),
-            controller_state=self._state,
+            controller_state=self.prompt_state(),
             conversation_history='\n'.join(conversation_history),
-            user_message=conversation_history[-1]
+            user_message=f"{chat_messages[-1].kind}: {chat_messages[-1].message}"
         )
 
         messages = [
@@ -101,7 +161,11 @@ class LLMInstructController(ControllerBase):
             LLMMessage.user_message(main_prompt),
         ]
 
-        response = self._llm.post_chat_request(messages).first_choice
+        try:
+            response = post_chat_request(self._llm, messages, budget, "LLMInstructController").first_choice
+        except BudgetExhaustedException as e:
+            logger.info(f"Controller stopped: {e}")
+            return []
         logger.debug(f"llm response: {response}")
 
         parsed = [self.parse_line(line, chains) for line in response.strip().splitlines()]
@@ -122,7 +186,7 @@ class LLMInstructController(ControllerBase):
                     budget,
                     initial_state=ChatMessage.chain(
                         message=instructions,
-                        data=self._state | {"iteration": self._state["iteration"]},
+                        data=self.resolved_state() | self._run_data,
                     ),
                     name=f"{chain.name};{score}",
                 )
@@ -163,8 +227,8 @@ class LLMInstructController(ControllerBase):
         # Get the top result
         scored_message = current_iteration_results[0]
 
-        # Update the controller state
-        self._state |= scored_message.message.data
+        # Update the controller state (large values are kept out of it, by handle)
+        self.update_state({k: v for k, v in scored_message.message.data.items() if k not in self._run_data})
 
         # Increment the controller iteration
         self._state["iteration"] += 1
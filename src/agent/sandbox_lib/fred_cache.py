@@ -0,0 +1,167 @@
+"""
+Local cache of FRED series, importable from code running in the sandbox.
+
+`Fred` is a drop-in replacement for `fredapi.Fred` whose `get_series` is served from FRED_CACHE_DIR while
+the cached copy is fresh. The agent warms the cache in the background before running generated code:
+
+    python -m fred_cache SERIES_ID [SERIES_ID ...]
+
+A series being downloaded has an in-flight marker (see `SeriesCache.fetching`): other processes needing it,
+e.g. the generated code while the warm-up still runs, wait for that download instead of starting another.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+import os
+import sys
+import time
+
+import fredapi
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: no in-flight markers, concurrent downloads of a series just overlap
+    fcntl = None
+
+
+def cache_dir():
+    path = os.getenv("FRED_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "council-fred-analyst")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class SeriesCache:
+    """Latest release of FRED series, one .npz file (int64 dates, float64 values) per series."""
+
+    def __init__(self, path=None, max_age=None, fetch_wait=120):
+        """
+        Parameters:
+            path (str): directory of the cached series (default: `series` under FRED_CACHE_DIR)
+            max_age (float): seconds a cached series stays fresh (default: FRED_CACHE_MAX_AGE)
+            fetch_wait (float): seconds to wait for another process downloading the same series
+        """
+        self.path = path or os.path.join(cache_dir(), "series")
+        self.max_age = max_age if max_age is not None else float(os.getenv("FRED_CACHE_MAX_AGE", 12 * 3600))
+        self.fetch_wait = fetch_wait
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, series_id, extension="npz"):
+        return os.path.join(self.path, f"{series_id.upper()}.{extension}")
+
+    @contextmanager
+    def fetching(self, series_id, wait=None):
+        """
+        Hold the in-flight marker of a series (an exclusive lock of its .lock file, released by the OS if the
+        process dies) while downloading it. Yields whether it is held: False if another process still held it
+        after `wait` seconds (default: `fetch_wait`).
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(self._file(series_id, "lock"), "a") as lock_file:
+            deadline = time.monotonic() + (self.fetch_wait if wait is None else wait)
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    held = True
+                except BlockingIOError:
+                    held = False
+                if held or time.monotonic() >= deadline:
+                    break
+                time.sleep(0.05)
+            try:
+                yield held
+            finally:
+                if held:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, series_id):
+        file = self._file(series_id)
+        try:
+            if time.time() - os.path.getmtime(file) > self.max_age:
+                return None
+            with np.load(file) as columns:
+                return pd.Series(columns["value"], index=pd.DatetimeIndex(columns["date"].astype("datetime64[ns]")))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, series_id, series):
+        # Write then rename, so that concurrent readers never see a partial file
+        file = self._file(series_id)
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(
+                f,
+                date=pd.DatetimeIndex(series.index).values.astype("datetime64[ns]").view("int64"),
+                value=series.to_numpy(dtype="float64", na_value=np.nan),
+            )
+        os.replace(tmp_file, file)
+
+
+class Fred(fredapi.Fred):
+    """`fredapi.Fred` with `get_series` served from a local `SeriesCache`."""
+
+    def __init__(self, *args, cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache or SeriesCache()
+        # FRED_API_URL points to a stand-in of the FRED API, e.g. the stub of `load_test.py`
+        self.root_url = os.getenv("FRED_API_URL") or self.root_url
+
+    def get_series(self, series_id, observation_start=None, observation_end=None, **kwargs):
+        if kwargs:
+            # Server-side transformations (units, frequency, ...) are not cached
+            return super().get_series(series_id, observation_start, observation_end, **kwargs)
+
+        series = self.cache.get(series_id)
+        if series is None:
+            # If another process is downloading it, wait for its copy rather than download it again
+            with self.cache.fetching(series_id):
+                series = self.cache.get(series_id)
+                if series is None:
+                    series = self.download(series_id)
+        start = pd.to_datetime(observation_start) if observation_start is not None else None
+        end = pd.to_datetime(observation_end) if observation_end is not None else None
+        return series.loc[start:end]
+
+    def download(self, series_id):
+        """Download the full series into the cache, whether or not it is there."""
+        series = super().get_series(series_id)
+        self.cache.put(series_id, series)
+        return series
+
+
+def warm(series_ids, max_workers=8, on_marked=None):
+    """
+    Download the given series into the cache, skipping the ones that are already fresh or being downloaded
+    by another process. `on_marked` is called once the in-flight markers of the others are held.
+    """
+    fred = Fred(api_key=os.getenv("FRED_API_KEY"))
+    markers = {}
+    for series_id in dict.fromkeys(series_ids):
+        if fred.cache.get(series_id) is not None:
+            continue
+        marker = ExitStack()
+        if marker.enter_context(fred.cache.fetching(series_id, wait=0)):
+            markers[series_id] = marker
+        else:
+            marker.close()
+    if on_marked is not None:
+        on_marked()
+
+    def fetch(series_id):
+        try:
+            fred.download(series_id)
+        except Exception as e:
+            print(f"fred_cache: could not fetch {series_id}: {e}", file=sys.stderr)
+        finally:
+            markers[series_id].close()
+
+    if markers:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(markers))) as pool:
+            list(pool.map(fetch, list(markers)))
+
+
+if __name__ == "__main__":
+    # The agent waits for this line before running code that may need the series (see `prefetch_series`)
+    warm(sys.argv[1:], on_marked=lambda: print("marked", flush=True))
@@ -0,0 +1,87 @@
+"""
+Helpers importable from code running in the sandbox (`sandbox_lib` is put on its PYTHONPATH).
+"""
+from concurrent.futures import ThreadPoolExecutor
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Period-end aliases renamed in pandas 2.2 (the old ones warn there, and fail from pandas 3)
+PERIOD_END_ALIASES = {"M": "ME", "Q": "QE", "A": "YE", "Y": "YE", "BM": "BME", "BQ": "BQE", "BA": "BYE", "BY": "BYE"}
+LEGACY_PERIOD_END_ALIASES = {"ME": "M", "QE": "Q", "YE": "A", "BME": "BM", "BQE": "BQ", "BYE": "BA"}
+
+
+def resample_rule(freq):
+    """
+    `freq` spelled the way the installed pandas accepts without a warning, e.g. 'M' becomes 'ME' on pandas 2.2
+    and later, and 'ME' becomes 'M' on older versions. Multiples and anchors are kept ('3M', 'Q-DEC').
+    """
+    match = re.fullmatch(r"(\d*)([A-Za-z]+)(-\w+)?", freq) if isinstance(freq, str) else None
+    if match is None:
+        return freq
+    count, base, anchor = match.group(1), match.group(2).upper(), match.group(3) or ""
+    if base in PERIOD_END_ALIASES:
+        candidates = [count + PERIOD_END_ALIASES[base] + anchor, freq]
+    elif base in LEGACY_PERIOD_END_ALIASES:
+        candidates = [freq, count + LEGACY_PERIOD_END_ALIASES[base] + anchor]
+    else:
+        return freq
+
+    for candidate in candidates:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                pd.tseries.frequencies.to_offset(candidate)
+            return candidate
+        except (ValueError, FutureWarning):
+            continue
+    return freq
+
+
+def get_panel(fred, series_ids, freq=None, how="mean", start=None, end=None, ffill=False, max_workers=8):
+    """
+    Fetch several FRED series concurrently and align them into a single DataFrame.
+
+    The result has one float64 column per series id, indexed by the union of all observation dates, and
+    is backed by one contiguous NumPy array (no repeated `pd.concat`/`merge`).
+
+    Parameters:
+        fred (Fred): a `fredapi.Fred` instance
+        series_ids (List[str]): FRED series ids, e.g. ['UNRATE', 'CPIAUCSL']
+        freq (str): optional pandas frequency to convert to, e.g. 'ME', 'QE', 'YE' or 'W' (the older 'M', 'Q'
+            and 'A' work too, whatever the pandas version)
+        how (str): aggregation used by the frequency conversion: 'mean', 'last', 'first', 'sum', 'min',
+            'max', or 'ffill' to upsample
+        start, end (str): optional observation start/end dates, e.g. '2000-01-01'
+        ffill (bool): forward-fill gaps left by aligning series with different calendars
+        max_workers (int): maximum number of concurrent downloads
+    """
+    series_ids = list(dict.fromkeys(series_ids))
+    if len(series_ids) == 0:
+        return pd.DataFrame(dtype="float64")
+
+    def fetch(series_id):
+        return fred.get_series(series_id, observation_start=start, observation_end=end)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(series_ids))) as pool:
+        fetched = list(pool.map(fetch, series_ids))
+
+    # Common calendar, as sorted int64 nanoseconds
+    dates = [pd.DatetimeIndex(s.index).values.astype("datetime64[ns]").view("int64") for s in fetched]
+    calendar = np.unique(np.concatenate(dates))
+
+    # One row per series: `block.T` is then handed to pandas as a single float64 block without copying
+    block = np.full((len(series_ids), len(calendar)), np.nan, dtype="float64")
+    for row, (series, series_dates) in enumerate(zip(fetched, dates)):
+        block[row, np.searchsorted(calendar, series_dates)] = series.to_numpy(dtype="float64", na_value=np.nan)
+
+    panel = pd.DataFrame(block.T, index=pd.DatetimeIndex(calendar, name="date"), columns=series_ids, copy=False)
+
+    if ffill:
+        panel = panel.ffill()
+    if freq is not None:
+        resampled = panel.resample(resample_rule(freq))
+        panel = resampled.ffill() if how == "ffill" else resampled.agg(how)
+    return panel
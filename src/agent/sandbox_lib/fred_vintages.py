@@ -0,0 +1,207 @@
+"""
+Local store of ALFRED vintages, importable from code running in the sandbox.
+
+Every observation of a series is kept as four sorted int64/float64 columns (date, realtime_start,
+realtime_end, value), so point-in-time queries are answered by binary search instead of another
+`get_series_all_releases` download.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from fred_cache import cache_dir
+
+# Rows are sorted by the composite key date * KEY_SPAN + (realtime_start + KEY_OFFSET)
+KEY_OFFSET = 2 ** 21
+KEY_SPAN = 2 ** 23
+
+
+def _to_days(values):
+    return pd.to_datetime(values).values.astype("datetime64[D]").astype("int64")
+
+
+def _to_dates(days):
+    return pd.DatetimeIndex(np.asarray(days).astype("datetime64[D]"))
+
+
+def fetch_all_releases(fred, series_id, realtime_start=None):
+    """
+    Every vintage of a series valid on or after `realtime_start`, as (date, realtime_start, realtime_end, value)
+    arrays. Same request as `fred.get_series_all_releases`, which drops FRED's realtime_end: without it, an
+    observation removed by a later vintage would look valid forever.
+    """
+    url = "%s/series/observations?series_id=%s&realtime_start=%s&realtime_end=%s" % (
+        fred.root_url,
+        series_id,
+        realtime_start or fred.earliest_realtime_start,
+        fred.latest_realtime_end,
+    )
+    # fredapi's own request helper: it adds the API key and turns API errors into ValueError
+    root = fred._Fred__fetch_data(url)
+    if root is None or not len(root):
+        raise ValueError("No data exists for series id: " + series_id)
+    rows = [child.attrib for child in root]
+    columns = [
+        np.array([row[name] for row in rows], dtype="datetime64[D]").astype("int64")
+        for name in ("date", "realtime_start", "realtime_end")
+    ]
+    value = np.array([np.nan if row["value"] == fred.nan_char else float(row["value"]) for row in rows])
+    return (*columns, value)
+
+
+class SeriesVintages:
+    """All vintages of one series, sorted by (date, realtime_start), with the day they were fetched."""
+
+    def __init__(self, date, realtime_start, realtime_end, value, fetched_on):
+        order = np.lexsort((realtime_start, date))
+        date, realtime_start, realtime_end, value = date[order], realtime_start[order], realtime_end[order], value[order]
+
+        # Coalesce consecutive vintages that did not change the value (e.g. rows re-reported by an incremental fetch)
+        same_date = date[1:] == date[:-1]
+        same_value = (value[1:] == value[:-1]) | (np.isnan(value[1:]) & np.isnan(value[:-1]))
+        contiguous = realtime_start[1:] <= realtime_end[:-1] + 1
+        keep = np.ones(len(date), dtype=bool)
+        keep[1:] = ~(same_date & same_value & contiguous)
+        runs = np.flatnonzero(keep)
+        self.date, self.realtime_start, self.value = date[runs], realtime_start[runs], value[runs]
+        self.realtime_end = np.maximum.reduceat(realtime_end, runs) if len(runs) else realtime_end[runs]
+        self.fetched_on = int(fetched_on)
+
+        self.key = self.date * KEY_SPAN + (self.realtime_start + KEY_OFFSET)
+        self.group_starts = np.flatnonzero(np.diff(self.date, prepend=self.date[:1] - 1) != 0)
+
+    @property
+    def latest_vintage(self):
+        return int(self.realtime_start.max()) if len(self.realtime_start) else None
+
+    def merge(self, other):
+        """
+        These vintages updated by `other`, fetched from `self.fetched_on` onwards. `other` holds every
+        vintage valid since then, so stored vintages it does not continue ended the day before.
+        """
+        kept = self.realtime_start < self.fetched_on
+        return SeriesVintages(
+            np.concatenate([self.date[kept], other.date]),
+            np.concatenate([self.realtime_start[kept], other.realtime_start]),
+            np.concatenate([np.minimum(self.realtime_end[kept], self.fetched_on - 1), other.realtime_end]),
+            np.concatenate([self.value[kept], other.value]),
+            other.fetched_on,
+        )
+
+    def as_of(self, day):
+        """Index of the vintage valid on `day` for every observation date that had been released by then."""
+        starts = self.group_starts
+        rows = np.searchsorted(self.key, self.date[starts] * KEY_SPAN + (day + KEY_OFFSET), side="right") - 1
+        valid = rows >= starts
+        rows = rows[valid]
+        return rows[self.realtime_end[rows] >= day]
+
+    @staticmethod
+    def fetch(fred, series_id, realtime_start=None):
+        today = int(np.datetime64("today", "D").astype("int64"))
+        return SeriesVintages(*fetch_all_releases(fred, series_id, realtime_start), fetched_on=today)
+
+    @staticmethod
+    def load(path):
+        """The stored vintages, or None if the file predates stored realtime_end columns."""
+        with np.load(path) as columns:
+            if "realtime_end" not in columns:
+                return None
+            return SeriesVintages(
+                columns["date"], columns["realtime_start"], columns["realtime_end"], columns["value"],
+                columns["fetched_on"],
+            )
+
+    def save(self, path):
+        # Write then rename, so that concurrent readers never see a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, date=self.date, realtime_start=self.realtime_start, realtime_end=self.realtime_end,
+                value=self.value, fetched_on=np.int64(self.fetched_on),
+            )
+        os.replace(tmp_path, path)
+
+
+class VintageStore:
+    """
+    Point-in-time (ALFRED) data for FRED series, persisted on disk and refreshed incrementally.
+
+    The first query for a series downloads all of its vintages; later queries are answered locally. Once
+    the stored copy is older than `max_age` seconds, only vintages newer than the latest stored one are
+    fetched (FRED_CACHE_MAX_AGE by default, as for the latest releases in `fred_cache`).
+    """
+
+    def __init__(self, fred, path=None, max_age=None):
+        self.fred = fred
+        self.path = path or os.path.join(cache_dir(), "vintages")
+        self.max_age = max_age if max_age is not None else float(os.getenv("FRED_CACHE_MAX_AGE", 12 * 3600))
+        self._series = {}
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, series_id):
+        return os.path.join(self.path, f"{series_id.upper()}.npz")
+
+    def _load(self, series_id):
+        file = self._file(series_id)
+        if series_id not in self._series and os.path.exists(file):
+            self._series[series_id] = SeriesVintages.load(file)
+        if self._series.get(series_id) is None or self._series[series_id].latest_vintage is None:
+            vintages = SeriesVintages.fetch(self.fred, series_id)
+            vintages.save(file)
+            self._series[series_id] = vintages
+        return self._series[series_id]
+
+    def _get(self, series_id):
+        vintages = self._load(series_id)
+        if time.time() - os.path.getmtime(self._file(series_id)) > self.max_age:
+            vintages = self.refresh(series_id)
+        return vintages
+
+    def refresh(self, series_id):
+        """Fetch and store only the vintages valid since the stored ones were fetched."""
+        vintages = self._load(series_id)
+        file = self._file(series_id)
+        start = np.datetime64(vintages.fetched_on, "D")
+        try:
+            vintages = vintages.merge(SeriesVintages.fetch(self.fred, series_id, realtime_start=str(start)))
+            vintages.save(file)
+            self._series[series_id] = vintages
+        except ValueError:
+            pass  # no observations in the new window
+        os.utime(file)
+        return vintages
+
+    def all_releases(self, series_id):
+        """
+        Every vintage as a DataFrame with columns 'date', 'realtime_start', 'realtime_end' and 'value'
+        (same as `fred.get_series_all_releases`, plus 'realtime_end').
+        """
+        vintages = self._get(series_id)
+        return pd.DataFrame({
+            "date": _to_dates(vintages.date),
+            "realtime_start": _to_dates(vintages.realtime_start),
+            "realtime_end": _to_dates(vintages.realtime_end),
+            "value": vintages.value,
+        })
+
+    def first_release(self, series_id):
+        """First released value of every observation (same as `fred.get_series_first_release`)."""
+        vintages = self._get(series_id)
+        rows = vintages.group_starts
+        return pd.Series(vintages.value[rows], index=_to_dates(vintages.date[rows]), name=series_id)
+
+    def as_of(self, series_id, as_of_date):
+        """
+        The series as it was known on `as_of_date`: for every observation date, the latest value released
+        on or before that day.
+        """
+        vintages = self._get(series_id)
+        rows = vintages.as_of(int(_to_days([as_of_date])[0]))
+        return pd.Series(vintages.value[rows], index=_to_dates(vintages.date[rows]), name=series_id)
+
+    def vintage_dates(self, series_id):
+        """Release dates of all stored vintages."""
+        return _to_dates(np.unique(self._get(series_id).realtime_start))
@@ -0,0 +1,194 @@
+"""
+Run a script like `python -c CODE` does, and write a JSON summary of where its time and memory went:
+
+    python -m profile_runner SUMMARY_PATH CODE
+
+The summary holds the script's hottest lines (sampled), its hottest functions (cProfile, main thread only),
+its peak memory (tracemalloc, and the process max RSS) and the time spent waiting on the network (all
+threads). Profiling slows the script down, so timings are best compared with each other, not with
+unprofiled runs.
+"""
+import builtins
+import cProfile
+import json
+import os
+import pstats
+import socket
+import ssl
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+# The file name `python -c` gives to the script, so that tracebacks read the same
+SCRIPT_NAME = "<string>"
+
+SAMPLE_INTERVAL = 0.005
+
+# Socket methods that block on the network; ssl.SSLSocket overrides most of them
+SOCKET_METHODS = ["connect", "connect_ex", "recv", "recv_into", "recvfrom", "send", "sendall", "sendto"]
+SSL_SOCKET_METHODS = SOCKET_METHODS + ["read", "write", "do_handshake"]
+
+# Entries of this runner itself, around the script
+RUNNER_FUNCTIONS = {"<built-in method builtins.exec>", "<method 'disable' of '_lsprof.Profiler' objects>"}
+
+
+class NetworkTimer:
+    """Time spent inside blocking socket calls and DNS lookups, summed over all threads."""
+
+    def __init__(self):
+        self.wait_seconds = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, function):
+        def timed(*args, **kwargs):
+            # SSL sockets call into their plain socket methods: only count the outermost call
+            if getattr(self._local, "active", False):
+                return function(*args, **kwargs)
+            self._local.active = True
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.active = False
+                with self._lock:
+                    self.wait_seconds += elapsed
+                    self.calls += 1
+
+        return timed
+
+    def install(self):
+        for cls, methods in [(socket.socket, SOCKET_METHODS), (ssl.SSLSocket, SSL_SOCKET_METHODS)]:
+            for name in methods:
+                if hasattr(cls, name):
+                    setattr(cls, name, self.wrap(getattr(cls, name)))
+        socket.getaddrinfo = self.wrap(socket.getaddrinfo)
+
+
+class LineSampler(threading.Thread):
+    """Sample the line of the script the main thread is in, including inside functions it calls."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name="profile-line-sampler", daemon=True)
+        self.interval = interval
+        self.seconds_by_line = {}
+        self._target = threading.main_thread().ident
+        self._stop_event = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self._target)
+            # The innermost frame of the script is the line to blame, whatever library code runs below it
+            while frame is not None and frame.f_code.co_filename != SCRIPT_NAME:
+                frame = frame.f_back
+            # Line 0: the script's frame is starting or unwinding, not on any line
+            if frame is not None and frame.f_lineno:
+                self.seconds_by_line[frame.f_lineno] = self.seconds_by_line.get(frame.f_lineno, 0.0) + now - last
+            last = now
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def short_path(path):
+    return os.path.join(*path.split(os.sep)[-2:]) if os.sep in path else path
+
+
+def function_hotspots(profiler, top=10):
+    stats = pstats.Stats(profiler).stats
+    rows = [item for item in stats.items() if item[0][2] not in RUNNER_FUNCTIONS]
+    rows = sorted(rows, key=lambda item: item[1][2], reverse=True)[:top]
+    return [
+        {
+            "function": f"{short_path(file)}:{line}({name})" if line else name,
+            "calls": calls,
+            "self_seconds": round(self_time, 4),
+            "cumulative_seconds": round(cumulative_time, 4),
+        }
+        for (file, line, name), (_, calls, self_time, cumulative_time, _) in rows
+    ]
+
+
+def line_hotspots(sampler, source_lines, top=10):
+    total = sum(sampler.seconds_by_line.values())
+    rows = sorted(sampler.seconds_by_line.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [
+        {
+            "line": line,
+            "source": source_lines[line - 1].strip() if 0 < line <= len(source_lines) else "",
+            "seconds": round(seconds, 4),
+            "share": round(seconds / total, 3) if total > 0 else 0.0,
+        }
+        for line, seconds in rows
+    ]
+
+
+def max_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def main(summary_path, code):
+    try:
+        compiled = compile(code, SCRIPT_NAME, "exec")
+    except SyntaxError as e:
+        traceback.print_exception(type(e), e, None)
+        return 1
+
+    sys.argv = ["-c"]
+    network = NetworkTimer()
+    network.install()
+    sampler = LineSampler()
+    profiler = cProfile.Profile()
+
+    status, error = 0, None
+    tracemalloc.start()
+    sampler.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    profiler.enable()
+    try:
+        exec(compiled, {"__name__": "__main__", "__builtins__": builtins})
+    except SystemExit as e:
+        status = e.code
+    except BaseException as e:
+        error, status = e, 1
+    finally:
+        profiler.disable()
+        wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        sampler.stop()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    if error is not None:
+        # Printed once profiling is off, so that it is not in the profile; and without this runner's frame,
+        # as `python -c` would
+        traceback.print_exception(type(error), error, error.__traceback__.tb_next)
+
+    summary = {
+        "wall_seconds": round(wall_seconds, 4),
+        "cpu_seconds": round(cpu_seconds, 4),
+        "peak_memory_bytes": peak_memory,
+        "max_rss_bytes": max_rss_bytes(),
+        "network": {"wait_seconds": round(network.wait_seconds, 4), "calls": network.calls},
+        "lines": line_hotspots(sampler, code.splitlines()),
+        "functions": function_hotspots(profiler),
+    }
+    with open(summary_path, "w") as f:
+        json.dump(summary, f)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1], sys.argv[2]))
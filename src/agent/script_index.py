@@ -0,0 +1,157 @@
+from collections import Counter
+from contextlib import contextmanager
+import json
+import math
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed
+    fcntl = None
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "code", "data", "for", "from", "i", "in", "is", "it",
+    "me", "of", "on", "or", "please", "python", "script", "show", "that", "the", "this", "to", "use", "using",
+    "we", "with", "you",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def task_constants(task: str) -> set:
+    """Numbers (e.g. years) and upper case identifiers (e.g. series ids) in a task, which a reused script must share."""
+    return set(re.findall(r"\d+(?:\.\d+)?", task)) | set(re.findall(r"\b[A-Z][A-Z0-9_]+\b", task))
+
+
+class ScriptIndex:
+    """
+    Local lexical (TF-IDF) index of (task, code, series ids) records for scripts that executed successfully.
+
+    Records are kept in memory and appended to a JSON lines file; only the most recent `max_records` are
+    kept. No external service is involved. Several processes can share the file: it is locked while read
+    or written, and reloaded when another process changed it.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_records: int = 500):
+        self._path = path
+        self._max_records = max_records
+        self._records = []
+        self._vectors = None
+        self._idf = {}
+        self._unseen_idf = 0.0
+        self._lock = threading.Lock()
+        self._file_signature = None
+
+        with self._lock:
+            self._refresh()
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        if self._path is None or fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        with open(self._path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _signature(self):
+        try:
+            stat = os.stat(self._path)
+        except (OSError, TypeError):
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh(self, file_locked: bool = False):
+        """Reload the records if the file changed since they were last read or written (by this process)."""
+        if self._path is None or self._signature() == self._file_signature:
+            return
+        if not file_locked:
+            with self._file_lock(exclusive=False):
+                return self._refresh(file_locked=True)
+
+        records = []
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        self._records = self._deduplicated(records)[-self._max_records:]
+        self._vectors = None
+        self._file_signature = self._signature()
+
+    @staticmethod
+    def _deduplicated(records):
+        # The latest record for a given script wins
+        by_code = {}
+        for record in records:
+            by_code.pop(record["code"], None)
+            by_code[record["code"]] = record
+        return list(by_code.values())
+
+    def _build(self):
+        documents = [Counter(tokenize(r["task"])) for r in self._records]
+        document_frequency = Counter(t for d in documents for t in d)
+        n = len(documents)
+        self._idf = {t: math.log((1 + n) / (1 + df)) + 1 for t, df in document_frequency.items()}
+        # Query terms no task has: they must still count against a match, as the rarest terms
+        self._unseen_idf = math.log(1 + n) + 1
+        self._vectors = [self._vector(d) for d in documents]
+
+    def _vector(self, counts: Counter) -> dict:
+        vector = {t: c * self._idf.get(t, self._unseen_idf) for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {t: w / norm for t, w in vector.items()} if norm > 0 else {}
+
+    def add(self, task: str, code: str, series_ids: List[str]):
+        record = {"task": task, "code": code, "series_ids": list(series_ids)}
+        with self._lock, self._file_lock(exclusive=True):
+            self._refresh(file_locked=True)
+            count = len(self._records)
+            self._records = self._deduplicated(self._records + [record])
+            # Rewrite the file when a duplicate was replaced or old records are dropped, append otherwise
+            rewrite = len(self._records) != count + 1 or len(self._records) > self._max_records
+            self._records = self._records[-self._max_records:]
+            self._vectors = None
+
+            if self._path is not None:
+                if rewrite:
+                    # Replaced in one step, so that readers without the lock never see a partial file
+                    with open(self._path + ".tmp", "w") as f:
+                        f.writelines(json.dumps(r) + "\n" for r in self._records)
+                    os.replace(self._path + ".tmp", self._path)
+                else:
+                    with open(self._path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                self._file_signature = self._signature()
+
+    def search(self, task: str, top_k: int = 1) -> List[Tuple[float, dict]]:
+        """Records most similar to `task`, as (cosine similarity, record), best first."""
+        with self._lock:
+            self._refresh()
+            if self._vectors is None:
+                self._build()
+            query = self._vector(Counter(tokenize(task)))
+            scored = [
+                (sum(w * vector.get(t, 0.0) for t, w in query.items()), record)
+                for vector, record in zip(self._vectors, self._records)
+            ]
+        scored = [s for s in scored if s[0] > 0]
+        return sorted(scored, key=lambda s: s[0], reverse=True)[:top_k]
+
+    def best_match(self, task: str, threshold: float) -> Optional[Tuple[float, dict]]:
+        matches = self.search(task, top_k=1)
+        if len(matches) > 0 and matches[0][0] >= threshold:
+            return matches[0]
+        return None
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+from typing import Any, Iterable, Optional, Tuple
+
+from council.contexts import AgentContext, ChainHistory, ChatHistory, ChatMessage, ChatMessageKind, ScoredChatMessage
+
+# A state value standing for a blob. Not a string, so that no string value (e.g. posted code) is taken for one
+HANDLE_KEY = "__blob__"
+
+
+def text_bytes(value: str) -> int:
+    return len(value.encode())
+
+
+class BlobStore:
+    """
+    Size-capped store for the large values of one session (code, stdout, stderr), referenced by handle.
+
+    A handle is a `{HANDLE_KEY: key}` dict, and identical values share one. Once `max_bytes` is exceeded, the least recently used values are
+    evicted, except the ones still referenced (see `put`), which can take the store over `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 4 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._blobs = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_handle(value: Any) -> bool:
+        return isinstance(value, dict) and len(value) == 1 and isinstance(value.get(HANDLE_KEY), str)
+
+    def put(self, value: str, referenced: Iterable[dict] = ()) -> dict:
+        """
+        Store `value` and return its handle. The `referenced` handles (e.g. the ones in the controller state)
+        are not evicted to make room for it.
+        """
+        key = hashlib.sha1(value.encode()).hexdigest()[:16]
+        with self._lock:
+            if key in self._blobs:
+                self._blobs.move_to_end(key)
+                return {HANDLE_KEY: key}
+            self._blobs[key] = value
+            self._size_bytes += text_bytes(value)
+            keep = {h[HANDLE_KEY] for h in referenced} | {key}
+            for evictable in [k for k in self._blobs if k not in keep]:
+                if self._size_bytes <= self._max_bytes:
+                    break
+                self._size_bytes -= text_bytes(self._blobs.pop(evictable))
+        return {HANDLE_KEY: key}
+
+    def get(self, handle: dict) -> Optional[str]:
+        with self._lock:
+            value = self._blobs.get(handle[HANDLE_KEY])
+            if value is not None:
+                self._blobs.move_to_end(handle[HANDLE_KEY])
+            return value
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    # Sessions are kept as JSON in the app's state backend between requests (see `session_to_json`)
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"max_bytes": self._max_bytes, "blobs": list(self._blobs.items())}
+
+    @staticmethod
+    def from_dict(data: dict) -> "BlobStore":
+        store = BlobStore(data["max_bytes"])
+        store._blobs.update((key, value) for key, value in data["blobs"])
+        store._size_bytes = sum(text_bytes(value) for value in store._blobs.values())
+        return store
+
+    def __len__(self):
+        return len(self._blobs)
+
+
+def digest(value: Any, max_chars: int = 300) -> Any:
+    """Short version of a value, to be sent into prompts in place of the full value."""
+    if not isinstance(value, str) or len(value) <= max_chars:
+        return value
+    half = max_chars // 2
+    return f"{value[:half]}\n... ({len(value) - 2 * half} characters omitted) ...\n{value[-half:]}"
+
+
+def trim_agent_context(context: AgentContext, chain_history_window: int, chat_history_window: int):
+    """
+    Drop everything but the last `chain_history_window` chain executions (and evaluations) and the last
+    `chat_history_window` chat messages.
+    """
+
+    def iteration(chain_history):
+        data = chain_history.messages[0].data if len(chain_history.messages) > 0 else None
+        return data.get("iteration", -1) if isinstance(data, dict) else -1
+
+    # Chain histories are keyed by execution unit ("chain;score"), so recency comes from the controller iteration
+    executions = sorted(
+        ((iteration(h), name, h) for name, histories in context.chainHistory.items() for h in histories),
+        key=lambda item: item[0],
+    )
+    kept = {id(h) for _, _, h in executions[-chain_history_window:]}
+    for name in list(context.chainHistory.keys()):
+        context.chainHistory[name] = [h for h in context.chainHistory[name] if id(h) in kept]
+        if len(context.chainHistory[name]) == 0:
+            del context.chainHistory[name]
+
+    del context.evaluationHistory[:-chain_history_window]
+    del context.chatHistory._messages[:-chat_history_window]
+
+
+def message_size(message) -> int:
+    data = message.data if isinstance(message.data, dict) else {}
+    return text_bytes(message.message or "") + sum(text_bytes(v) for v in data.values() if isinstance(v, str))
+
+
+def memory_report(context: AgentContext, state: dict, blob_store: BlobStore) -> dict:
+    """Approximate memory held by one session, in UTF-8 bytes of message and data text."""
+    chain_histories = [h for histories in context.chainHistory.values() for h in histories]
+    return {
+        "chat_messages": len(context.chatHistory._messages),
+        "chat_bytes": sum(message_size(m) for m in context.chatHistory.messages),
+        "chain_histories": len(chain_histories),
+        "chain_bytes": sum(message_size(m) for h in chain_histories for m in h.messages),
+        "evaluations": len(context.evaluationHistory),
+        "controller_state_bytes": sum(text_bytes(str(v)) for v in state.values()),
+        "blobs": len(blob_store),
+        "blob_bytes": blob_store.size_bytes,
+    }
+
+
+def _message_to_dict(message: ChatMessage) -> dict:
+    return {
+        "message": message.message,
+        "kind": message.kind.value,
+        "data": message.data,
+        "source": message.source,
+        "is_error": message.is_error,
+    }
+
+
+def _message_from_dict(data: dict) -> ChatMessage:
+    return ChatMessage(
+        data["message"], ChatMessageKind(data["kind"]), data=data["data"], source=data["source"], is_error=data["is_error"]
+    )
+
+
+def session_to_json(context: AgentContext, state: dict, blob_store: BlobStore) -> str:
+    """
+    A session as JSON, to keep it in a shared store: unlike a pickle, loading it cannot run code. Values that
+    JSON cannot hold (none are expected) are kept as text.
+    """
+    return json.dumps({
+        "chat": [_message_to_dict(m) for m in context.chatHistory.messages],
+        "chains": {
+            name: [[_message_to_dict(m) for m in h.messages] for h in histories]
+            for name, histories in context.chainHistory.items()
+        },
+        "evaluations": [
+            [{"message": _message_to_dict(s.message), "score": s.score} for s in iteration]
+            for iteration in context.evaluationHistory
+        ],
+        "state": state,
+        "blobs": blob_store.to_dict(),
+    }, default=str)
+
+
+def session_from_json(payload: str) -> Tuple[AgentContext, dict, BlobStore]:
+    """The context, controller state and blob store of a session saved by `session_to_json`."""
+    session = json.loads(payload)
+    context = AgentContext(chat_history=ChatHistory())
+    context.chatHistory._messages.extend(_message_from_dict(m) for m in session["chat"])
+    context.chainHistory.update({
+        name: [ChainHistory([_message_from_dict(m) for m in messages]) for messages in histories]
+        for name, histories in session["chains"].items()
+    })
+    context.evaluationHistory.extend(
+        [ScoredChatMessage(_message_from_dict(s["message"]), s["score"]) for s in iteration]
+        for iteration in session["evaluations"]
+    )
+    return context, session["state"], BlobStore.from_dict(session["blobs"])
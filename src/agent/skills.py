@@ -3,16 +3,98 @@ from council.contexts import ChatMessage, ChainContext
 from council.runners import Budget
 from council.llm import LLMBase, LLMMessage
 
-from code_sandbox import run_code_in_sandbox
+from budgeting import DEADLINE_MARGIN, BudgetExhaustedException, check_budget, post_chat_request
+from code_sandbox import WorkspacePool, format_profile, run_code_in_sandbox, prefetch_series
+from script_index import ScriptIndex, task_constants
 
 import ast
 import logging
 import re
+import time
 from string import Template
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 logger = logging.getLogger("council")
 
+# Skills that write code for a task, setting the 'task' of their output
+TASK_SKILLS = {"FredDataSpecialist", "PythonCodeEditorSkill"}
+
+# Calls whose string arguments are FRED series ids served by the sandbox's series cache
+FRED_SERIES_CALLS = {"get_series": 0, "get_series_latest_release": 0, "get_panel": 1}
+
+
+def extract_series_ids(code):
+    """
+    Statically find the FRED series ids used by `code`: string literals passed to `fred.get_series(...)` or
+    `get_panel(fred, [...])`, directly or through a variable bound to a literal list or a `for` loop over one.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+
+    def literals(node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return [node.value]
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            return [e.value for e in node.elts if isinstance(e, ast.Constant) and isinstance(e.value, str)]
+        if isinstance(node, ast.Dict):
+            return [k.value for k in node.keys if isinstance(k, ast.Constant) and isinstance(k.value, str)]
+        return []
+
+    # Names bound to literals, e.g. `series = ['UNRATE', 'CPIAUCSL']` or `for s in ['UNRATE', 'CPIAUCSL']:`
+    bindings = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    bindings.setdefault(target.id, []).extend(literals(node.value))
+        elif isinstance(node, ast.For) and isinstance(node.target, ast.Name):
+            bindings.setdefault(node.target.id, []).extend(literals(node.iter))
+
+    series_ids = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = getattr(node.func, "attr", None) or getattr(node.func, "id", None)
+        position = FRED_SERIES_CALLS.get(name)
+        if position is None or len(node.args) <= position:
+            continue
+        arg = node.args[position]
+        series_ids += bindings.get(arg.id, []) if isinstance(arg, ast.Name) else literals(arg)
+    return list(dict.fromkeys(series_ids))
+
+
+def lookup_script(skill, context: ChainContext, task: str, code: str):
+    """
+    Look `task` up in the script index of `skill` (a `FredDataSpecialist` or `PythonCodeEditorSkill`).
+
+    Returns the skill's reply reusing a known-good script as is, or None, and the closest match to show the
+    LLM as a reference, or None. A script is only reused for new code, and for a task at least
+    `reuse_threshold` similar that has the same numbers and upper case identifiers (years, series ids).
+    """
+    match = skill.script_index.best_match(task, skill.example_threshold) if skill.script_index else None
+    if match is None or code or match[0] < skill.reuse_threshold:
+        return None, match
+    if task_constants(task) != task_constants(match[1]["task"]):
+        return None, match
+
+    logger.debug(f"{skill.name}, reusing script for task: {match[1]['task']}")
+    reused = ChatMessage.skill(
+        source=skill.name,
+        message="I've reused code that worked for a similar task and placed it in the 'data' field.",
+        data=context.last_message.data | {'code': match[1]['code'], 'task': task, 'profile': None},
+    )
+    return reused, match
+
+
+def format_reference_script(match) -> str:
+    if match is None:
+        return "None."
+    _, record = match
+    return f"Task: {record['task']}\n```python\n{record['code']}\n```"
+
+
 class FredDataSpecialist(SkillBase):
     """Specialized skill to retrieve data from FRED."""
 
@@ -22,25 +104,43 @@ class FredDataSpecialist(SkillBase):
         system_prompt: str,
         main_prompt_template: Template,
         code_header: str,
+        script_index: Optional[ScriptIndex] = None,
+        reuse_threshold: float = 0.9,
+        example_threshold: float = 0.4,
     ):
-        """Build a new FredDataSpecialist."""
+        """
+        Build a new FredDataSpecialist.
+
+        With a `script_index`, a known-good script for a task at least `reuse_threshold` similar is reused as
+        is (when there is no existing code), and one at least `example_threshold` similar is given to the LLM
+        as a reference.
+        """
 
         super().__init__(name="FredDataSpecialist")
         self.llm = llm
         self.system_prompt = LLMMessage.system_message(system_prompt)
         self.main_prompt_template = main_prompt_template
         self.code_header = code_header
+        self.script_index = script_index
+        self.reuse_threshold = reuse_threshold
+        self.example_threshold = example_threshold
 
-    def execute(self, context: ChainContext, _budget: Budget) -> ChatMessage:
+    def execute(self, context: ChainContext, budget: Budget) -> ChatMessage:
         """Execute `FredDataSpecialist`."""
         
         # Get the code
         code = context.last_message.data['code']
+        task = context.last_message.message
+
+        reused, match = lookup_script(self, context, task, code)
+        if reused is not None:
+            return reused
 
         main_prompt = self.main_prompt_template.substitute(
             code_header=self.code_header,
-            task=context.last_message.message,
+            task=task,
             existing_code=code,
+            reference_script=format_reference_script(match),
         )
 
         messages_to_llm = [
@@ -50,14 +150,19 @@ class FredDataSpecialist(SkillBase):
             ),
         ]
 
-        llm_response = self.llm.post_chat_request(messages=messages_to_llm).first_choice
+        try:
+            llm_response = post_chat_request(self.llm, messages_to_llm, budget, self.name).first_choice
+        except BudgetExhaustedException as e:
+            return ChatMessage.skill(
+                source=self.name, message=f"I stopped before finishing: {e}.", data=context.last_message.data, is_error=True
+            )
 
         logger.debug(f"{self.name}, generated code: {llm_response}")
 
         return ChatMessage.skill(
             source=self.name,
             message="I've generated code for you and placed it in the 'data' field.",
-            data= context.last_message.data | {'code': llm_response},
+            data=context.last_message.data | {'code': llm_response, 'task': task, 'profile': None},
         )
 
 
@@ -70,25 +175,38 @@ class PythonCodeEditorSkill(SkillBase):
         system_prompt: str,
         editor_prompt_template: Template,
         code_header: str,
+        script_index: Optional[ScriptIndex] = None,
+        reuse_threshold: float = 0.9,
+        example_threshold: float = 0.4,
     ):
-        """Build a new PythonDataAnalystSkill."""
+        """Build a new PythonDataAnalystSkill. `script_index` is used as in `FredDataSpecialist`."""
 
         super().__init__(name="PythonCodeEditorSkill")
         self.llm = llm
         self.system_prompt = LLMMessage.system_message(system_prompt)
         self.editor_prompt_template = editor_prompt_template
         self.code_header = code_header
+        self.script_index = script_index
+        self.reuse_threshold = reuse_threshold
+        self.example_threshold = example_threshold
 
-    def execute(self, context: ChainContext, _budget: Budget) -> ChatMessage:
+    def execute(self, context: ChainContext, budget: Budget) -> ChatMessage:
         """Execute `PythonCodeEditorSkill`."""
 
         # Get the code
         code = context.last_message.data['code']
+        task = context.last_message.message
+
+        reused, match = lookup_script(self, context, task, code)
+        if reused is not None:
+            return reused
 
         editor_prompt = self.editor_prompt_template.substitute(
             existing_code=code,
             code_header=self.code_header,
-            task=context.last_message.message,
+            task=task,
+            reference_script=format_reference_script(match),
+            performance_profile=format_profile(context.last_message.data.get('profile')),
         )
 
         messages_to_llm = [
@@ -98,14 +216,19 @@ class PythonCodeEditorSkill(SkillBase):
             ),
         ]
 
-        llm_response = self.llm.post_chat_request(messages=messages_to_llm).first_choice
+        try:
+            llm_response = post_chat_request(self.llm, messages_to_llm, budget, self.name).first_choice
+        except BudgetExhaustedException as e:
+            return ChatMessage.skill(
+                source=self.name, message=f"I stopped before finishing: {e}.", data=context.last_message.data, is_error=True
+            )
 
         logger.debug(f"{self.name}, generated code: {llm_response}")
 
         return ChatMessage.skill(
             source=self.name,
             message="I've edited code for you and placed the result in the 'data' field.",
-            data=context.last_message.data | {'code': llm_response},
+            data=context.last_message.data | {'code': llm_response, 'task': task, 'profile': None},
         )
 
 
@@ -141,6 +264,31 @@ class ParsePythonSkill(SkillBase):
             return ChatMessage.skill(source=self.name, message=message, data=context.last_message.data | {'code': python_code}, is_error=True)
 
 
+class PrefetchFredSeriesSkill(SkillBase):
+    """Start downloading the FRED series used by the parsed code, while the chain proceeds."""
+
+    def __init__(self, python_bin_dir: str):
+        super().__init__(name="PrefetchFredSeriesSkill")
+        self.python_bin_dir = python_bin_dir
+
+    def execute(self, context: ChainContext, _budget: Budget) -> ChatMessage:
+        last_message = context.last_message
+
+        if not last_message.is_error:
+            series_ids = extract_series_ids(last_message.data['code'] or "")
+            if len(series_ids) > 0:
+                logger.debug(f"{self.name}, prefetching series: {series_ids}")
+                try:
+                    prefetch_series(series_ids, self.python_bin_dir)
+                except OSError as e:
+                    logger.warning(f"{self.name}, failed to start prefetch: {e}")
+
+        # Pass the parsing result through unchanged
+        return ChatMessage.skill(
+            source=self.name, message=last_message.message, data=last_message.data, is_error=last_message.is_error
+        )
+
+
 class PythonExecutionSkill(SkillBase):
     def __init__(
         self,
@@ -149,6 +297,8 @@ class PythonExecutionSkill(SkillBase):
         error_correction_template: Template,
         code_header: str,
         python_bin_dir: str,
+        script_index: Optional[ScriptIndex] = None,
+        workspace_pool: Optional[WorkspacePool] = None,
     ):
         super().__init__(name="PythonExecutionSkill")
         self.llm = llm
@@ -156,8 +306,10 @@ class PythonExecutionSkill(SkillBase):
         self.error_correction_template = error_correction_template
         self.code_header = code_header
         self.python_bin_dir = python_bin_dir
+        self.script_index = script_index
+        self.workspace_pool = workspace_pool
 
-    def error_correction(self, code, error, conversation_history, task):
+    def error_correction(self, code, error, conversation_history, task, budget):
         error_correction_llm_input = self.error_correction_template.substitute(
             conversation_history=conversation_history,
             task=task,
@@ -170,11 +322,13 @@ class PythonExecutionSkill(SkillBase):
             LLMMessage.system_message(self.system_prompt),
             LLMMessage.assistant_message(error_correction_llm_input),
         ]
-        llm_response = self.llm.post_chat_request(messages=messages_to_llm).first_choice
+        llm_response = post_chat_request(self.llm, messages_to_llm, budget, self.name).first_choice
         logger.debug(f"{self.name}, corrected code: {llm_response}")
         return llm_response
 
-    def execute_code(self, data, code):
+    def execute_code(self, data, code, timeout=None, indexed_task=None):
+        # Profiling is opted into per turn, through the controller state
+        profile = bool(data.get("profiling"))
 
         is_code = False
         try:
@@ -197,19 +351,29 @@ class PythonExecutionSkill(SkillBase):
                 return ChatMessage.skill(source=self.name, message=message, data={'code': code}, is_error=True)
 
         try:
-            # Run the Python file as a subprocess
-            exec_result = run_code_in_sandbox(code, self.python_bin_dir)
+            # Run the Python file as a subprocess, in the session's workspace (the session id comes with the controller state)
+            workspace = None
+            if self.workspace_pool is not None and data.get("session_id") is not None:
+                workspace = self.workspace_pool.workspace(data["session_id"])
+            exec_result = run_code_in_sandbox(
+                code, self.python_bin_dir, timeout=timeout, profile=profile, workspace=workspace
+            )
 
             data = data | {
                 "code": code,
                 "stdout": exec_result['stdout'],
                 "stderr": exec_result['stderr'],
+                "profile": exec_result.get('profile'),
             }
             if exec_result["returncode"] == 0:
                 logger.debug(f"{self.name}, executed code: {data}")
+                if self.script_index is not None and indexed_task:
+                    self.script_index.add(indexed_task, code, extract_series_ids(code))
                 message_to_user = data['stdout'].strip()
                 if len(message_to_user) < 1:
                     message_to_user = "Python code executed successfully."
+                if data["profile"] is not None:
+                    message_to_user += f"\n\nProfile:\n{format_profile(data['profile'])}"
                 return ChatMessage.skill(
                     source=self.name,
                     message=message_to_user,
@@ -228,6 +392,7 @@ class PythonExecutionSkill(SkillBase):
                 "code": code,
                 "stdout": "",
                 "stderr": "",
+                "profile": None,
             }
             logger.debug(f"{self.name}, failed to execute code: {data}")
             return ChatMessage.skill(
@@ -242,6 +407,9 @@ class PythonExecutionSkill(SkillBase):
     ) -> ChatMessage:
         """
         Try to execute a Python file, collecting output (or error message) from the standard output.
+
+        Each execution gets the remaining time of the budget as its deadline, and no further correction is
+        attempted once the budget is exhausted or another attempt is not expected to fit in what is left.
         """
 
         # Get the chat message history
@@ -257,19 +425,47 @@ class PythonExecutionSkill(SkillBase):
         # Get the current chain context - the last item in the chainHistory
         code = context.last_message.data['code']
 
-        for _ in range(num_retries):
-            skill_message = self.execute_code(context.last_message.data, code)
+        # Only scripts written for a task in this chain run are indexed: the task in the data can be left over
+        # from an earlier turn, and the code replaced since (e.g. edited by the user)
+        indexed_task = None
+        for message in context.current.messages:
+            if message.source in TASK_SKILLS and not message.is_error and isinstance(message.data, dict):
+                indexed_task = message.data.get("task")
+
+        last_attempt_duration = 0
+        for attempt in range(num_retries):
+            started = time.monotonic()
+            timeout = budget.remaining_duration - DEADLINE_MARGIN
+            if timeout <= 0:
+                skill_message = ChatMessage.skill(
+                    source=self.name,
+                    message="There is no time left in the budget of this request to execute the code.",
+                    data=context.last_message.data | {"code": code, "stdout": "", "stderr": ""},
+                    is_error=True,
+                )
+                break
+            skill_message = self.execute_code(context.last_message.data, code, timeout=timeout, indexed_task=indexed_task)
             if isinstance(skill_message, ChatMessage):
-                if len(skill_message.data['stderr']) < 1:
+                if len(skill_message.data.get('stderr', '')) < 1:
                     return skill_message
-            
+
+            if attempt == num_retries - 1:
+                break
+
             # Will run even if stderr only has warnings
-            code = self.error_correction(
-                code,
-                skill_message.data["stderr"],
-                conversation_history,
-                last_message,
-            )
+            try:
+                check_budget(budget, min_duration=last_attempt_duration)
+                code = self.error_correction(
+                    code,
+                    skill_message.data.get("stderr", ""),
+                    conversation_history,
+                    last_message,
+                    budget,
+                )
+            except BudgetExhaustedException as e:
+                logger.info(f"{self.name}, no more corrections: {e}")
+                break
+            last_attempt_duration = time.monotonic() - started
 
         return skill_message
 
@@ -288,7 +484,7 @@ class GeneralSkill(SkillBase):
         self.llm = llm
         self.system_prompt = LLMMessage.system_message(system_prompt)
 
-    def execute(self, context: ChainContext, _budget: Budget) -> ChatMessage:
+    def execute(self, context: ChainContext, budget: Budget) -> ChatMessage:
         """Execute `GeneralSkill`."""
 
         # Get the instruction
@@ -299,7 +495,12 @@ class GeneralSkill(SkillBase):
             LLMMessage.assistant_message(instruction)
         ]
 
-        llm_response = self.llm.post_chat_request(messages=messages_to_llm).first_choice
+        try:
+            llm_response = post_chat_request(self.llm, messages_to_llm, budget, self.name).first_choice
+        except BudgetExhaustedException as e:
+            return ChatMessage.skill(
+                source=self.name, message=f"I stopped before finishing: {e}.", data=context.last_message.data, is_error=True
+            )
 
         logger.debug(f"{self.name}, response: {llm_response}")
 
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The agent's modules import each other as top-level modules, as when run from `src/agent` or `src/flask-app`,
+# and sandboxed code imports `sandbox_lib`'s modules the same way
+AGENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENT_DIR)
+sys.path.insert(0, os.path.join(AGENT_DIR, "sandbox_lib"))
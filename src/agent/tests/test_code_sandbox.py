@@ -0,0 +1,24 @@
+import os
+import stat
+import subprocess
+import sys
+
+from code_sandbox import protect_interpreter
+
+
+def test_protect_interpreter_makes_venv_read_only(tmp_path):
+    venv = tmp_path / "code_sandbox"
+    subprocess.run([sys.executable, "-m", "venv", "--without-pip", str(venv)], check=True)
+    site_packages = next(venv.glob("lib/python*/site-packages"))
+    (site_packages / "shared.py").write_text("VALUE = 1\n")
+
+    protect_interpreter(str(venv / "bin"))
+    for path in [venv, site_packages, site_packages / "shared.py", venv / "pyvenv.cfg"]:
+        assert os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH) == 0
+
+    # Done again by every pool started on the same venv
+    protect_interpreter(str(venv / "bin"))
+
+    # So that the temporary directory can be deleted
+    for directory, _, _ in os.walk(venv):
+        os.chmod(directory, 0o755)
@@ -0,0 +1,49 @@
+from skills import extract_series_ids
+
+
+def test_literal_arguments():
+    code = """
+fred = Fred(api_key=key)
+unrate = fred.get_series('UNRATE')
+gdp = fred.get_series_latest_release("GDP", observation_start='2000-01-01')
+panel = get_panel(fred, ['CPIAUCSL', 'FEDFUNDS'], freq='ME')
+"""
+    assert extract_series_ids(code) == ["UNRATE", "GDP", "CPIAUCSL", "FEDFUNDS"]
+
+
+def test_names_bound_to_literals():
+    code = """
+series = ['UNRATE', 'CPIAUCSL']
+panel = get_panel(fred, series)
+for series_id in ('GDP', 'GDPC1'):
+    data[series_id] = fred.get_series(series_id)
+labels = {'DGS10': '10 year', 'DGS2': '2 year'}
+for key in labels:
+    fred.get_series(key)
+"""
+    assert extract_series_ids(code) == ["UNRATE", "CPIAUCSL", "GDP", "GDPC1"]
+
+
+def test_dict_keys_and_duplicates():
+    code = """
+names = {'DGS10': '10 year', 'DGS2': '2 year'}
+panel = get_panel(fred, {'DGS10': '10 year', 'DGS2': '2 year'})
+fred.get_series('DGS10')
+"""
+    assert extract_series_ids(code) == ["DGS10", "DGS2"]
+
+
+def test_ignores_other_calls_and_unknown_arguments():
+    code = """
+df = pd.read_csv('UNRATE.csv')
+fred.search('unemployment')
+fred.get_series(series_id_from_user)
+fred.get_series(f'{prefix}RATE')
+get_panel(['UNRATE'])
+"""
+    assert extract_series_ids(code) == []
+
+
+def test_invalid_code():
+    assert extract_series_ids("fred.get_series('UNRATE'") == []
+    assert extract_series_ids("") == []
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import pandas as pd
+
+from fred_cache import Fred, SeriesCache
+
+SERIES = pd.Series([3.5, 3.6], index=pd.DatetimeIndex(["2023-01-01", "2023-02-01"]))
+
+
+def make_fred(cache, downloads):
+    fred = Fred(api_key="0" * 32, cache=cache)
+
+    def download(series_id):
+        downloads.append(series_id)
+        cache.put(series_id, SERIES)
+        return SERIES
+
+    fred.download = download
+    return fred
+
+
+def hold_marker(cache, series_id, seconds, put):
+    marked = threading.Event()
+
+    def fetch():
+        with cache.fetching(series_id):
+            marked.set()
+            time.sleep(seconds)
+            if put:
+                cache.put(series_id, SERIES)
+
+    thread = threading.Thread(target=fetch)
+    thread.start()
+    marked.wait()
+    return thread
+
+
+def test_waits_for_series_in_flight(tmp_path):
+    cache = SeriesCache(str(tmp_path), max_age=3600)
+    downloads = []
+    thread = hold_marker(cache, "UNRATE", 0.3, put=True)
+
+    series = make_fred(cache, downloads).get_series("UNRATE")
+    thread.join()
+    assert downloads == []
+    assert series.tolist() == [3.5, 3.6]
+
+
+def test_downloads_when_the_fetch_in_flight_fails_or_stalls(tmp_path):
+    downloads = []
+    cache = SeriesCache(str(tmp_path), max_age=3600)
+    thread = hold_marker(cache, "UNRATE", 0.1, put=False)
+    make_fred(cache, downloads).get_series("UNRATE")
+    thread.join()
+
+    stalled_cache = SeriesCache(str(tmp_path), max_age=3600, fetch_wait=0.1)
+    thread = hold_marker(stalled_cache, "GDP", 1, put=False)
+    make_fred(stalled_cache, downloads).get_series("GDP")
+    thread.join()
+    assert downloads == ["UNRATE", "GDP"]
@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+from council.contexts import ChainContext, ChatMessage
+
+from script_index import ScriptIndex, task_constants
+from skills import lookup_script
+
+
+def make_index():
+    index = ScriptIndex()
+    index.add("Table of quarterly GDP growth", "print('gdp')", [])
+    index.add("Plot the US unemployment rate against CPI inflation since 1990", "print('unrate')", ["UNRATE"])
+    return index
+
+
+def make_skill(index):
+    return SimpleNamespace(name="PythonCodeEditorSkill", script_index=index, reuse_threshold=0.9, example_threshold=0.4)
+
+
+def make_context():
+    context = ChainContext.from_user_message("task")
+    context.new_iteration()
+    context.current.append(ChatMessage.chain("task", data={"code": None, "iteration": 0}))
+    return context
+
+
+def test_identical_task_matches_exactly():
+    score, record = make_index().search("table of the quarterly GDP growth")[0]
+    assert score > 0.99
+    assert record["code"] == "print('gdp')"
+
+
+def test_unseen_query_terms_lower_the_score():
+    score, _ = make_index().search("Table of quarterly GDP growth for France")[0]
+    assert score < 0.9
+
+
+def test_task_constants():
+    assert task_constants("Plot UNRATE since 1990, at 2.5%") == {"UNRATE", "1990", "2.5"}
+
+
+def test_reuses_script_for_the_same_task():
+    reused, match = lookup_script(make_skill(make_index()), make_context(), "Table of quarterly GDP growth", None)
+    assert reused is not None
+    assert reused.data["code"] == "print('gdp')"
+    assert match[1]["code"] == "print('gdp')"
+
+
+def test_does_not_reuse_for_other_numbers_or_places():
+    skill = make_skill(make_index())
+    for task in [
+        "Plot the US unemployment rate against CPI inflation since 2015",
+        "Table of quarterly GDP growth for France",
+    ]:
+        reused, match = lookup_script(skill, make_context(), task, None)
+        assert reused is None
+        # Still good enough as a reference for the LLM
+        assert match is not None
+
+
+def test_does_not_reuse_over_existing_code():
+    reused, _ = lookup_script(make_skill(make_index()), make_context(), "Table of quarterly GDP growth", "print(1)")
+    assert reused is None
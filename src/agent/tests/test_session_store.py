@@ -0,0 +1,34 @@
+from council.contexts import AgentContext, ChatHistory
+
+from council_controller import LLMInstructController
+from session_store import BlobStore, session_from_json, session_to_json
+
+
+def make_controller(max_bytes=3000):
+    return LLMInstructController(llm=None, blob_store=BlobStore(max_bytes), blob_threshold=100)
+
+
+def test_strings_are_never_taken_for_handles():
+    controller = make_controller()
+    controller.set_state("code", "blob:0123456789abcdef")
+    controller.set_state("stdout", "blob:" + "x" * 200)
+    _, state, blob_store = session_from_json(
+        session_to_json(AgentContext(chat_history=ChatHistory()), controller.state, controller.blob_store)
+    )
+    resumed = LLMInstructController(llm=None, blob_store=blob_store, state=state)
+    assert resumed.get_state("code") == "blob:0123456789abcdef"
+    assert resumed.get_state("stdout") == "blob:" + "x" * 200
+
+
+def test_size_in_bytes_and_referenced_blobs_kept():
+    controller = make_controller()
+    controller.set_state("code", "é" * 1000)
+    assert controller.blob_store.size_bytes == 2000
+
+    controller.set_state("stdout", "x" * 1500)
+    assert controller.get_state("code") == "é" * 1000
+    assert controller.blob_store.size_bytes == 3500
+
+    controller.set_state("stdout", "y" * 1500)
+    assert len(controller.blob_store) == 2
+    assert controller.blob_store.size_bytes == 3500
@@ -1,190 +1,506 @@
-from council.llm import AzureLLM
-from council.runners import Budget
-from council.contexts import AgentContext, ChatHistory
-from council.agents import Agent
-from council.chains import Chain
-from council.llm.openai_llm import OpenAILLM
-
-import dotenv
-
-dotenv.load_dotenv()
-
-import sys
-from string import Template
-import toml
+from contextlib import contextmanager
+import contextvars
 import logging
 import os
+import sys
+import threading
+from string import Template
+from typing import NamedTuple
 
 logging.getLogger("council").setLevel(logging.INFO)
 sys.path.append("../agent")
 
-from skills import (
-    FredDataSpecialist,
-    PythonCodeEditorSkill,
-    ParsePythonSkill,
-    PythonExecutionSkill,
-    GeneralSkill,
-)
-from council_controller import LLMInstructController
-from evaluator import BasicEvaluatorWithSource
-from llm_fallback import LLMFallback
+PROMPTS_DIR = "../agent/prompts"
+
+DEFAULT_SESSION = "default"
+
+# Session of the turn running in the current thread, for log handlers that publish its events
+current_session_id = contextvars.ContextVar("current_session_id", default=None)
+
+
+class SessionBusy(Exception):
+    pass
+
+
+class Session(NamedTuple):
+    """One conversation, as loaded from the state backend for one request."""
+
+    context: object
+    controller: object
+    agent: object
+
+
+def lazy(build):
+    """
+    Like `functools.cached_property`, but the component is built under the AgentApp lock so that
+    the warm-up thread and a request thread never construct it twice.
+    """
+    name = build.__name__
+
+    def getter(self):
+        if name not in self._components:
+            with self._lock:
+                if name not in self._components:
+                    self._components[name] = build(self)
+        return self._components[name]
+
+    return property(getter, doc=build.__doc__)
 
 
 class AgentApp:
-    def __init__(self):
-        self.context = AgentContext(chat_history=ChatHistory())
-        self.llm = LLMFallback(OpenAILLM.from_env(), AzureLLM.from_env(), retry_before_fallback=1)
-        self.load_prompts()
-        self.init_skills()
-        self.init_chains()
-        self.init_controller()
-        self.init_evaluator()
-        self.init_agent()
-
-    def load_prompts(self):
-        # Load prompts and prompt templates
-
-        self.fred_system_prompt = toml.load("../agent/prompts/fred_data_specialist_prompts.toml")[
-            "system_message"
-        ]["prompt"]
-
-        self.fred_prompt_template = Template(
-            toml.load("../agent/prompts/fred_data_specialist_prompts.toml")["main_prompt"]["prompt"]
-        )
+    """
+    The agent, built lazily: nothing heavy (council, LLM clients, prompts) is imported or
+    instantiated until a request actually needs it. Call `warm_up` to build everything ahead of time.
 
-        self.code_header = toml.load("../agent/prompts/description.toml")["code_header"][
-            "code"
-        ]
-        self.code_editor_system_prompt = toml.load(
-            "../agent/prompts/code_editor_prompt.toml"
-        )["system_message"]["prompt"]
+    LLM clients, skills and chains are shared by all conversations. Each conversation (session) is kept in
+    the state backend (STATE_BACKEND_URL, see `state_backends`) between requests, so that with a shared
+    backend any worker process can serve any request.
+    """
 
-        self.code_editor_prompt_template = Template(
-            toml.load("../agent/prompts/code_editor_prompt.toml")["main_prompt"][
-                "prompt"
-            ]
+    def __init__(
+        self,
+        chain_history_window=5,
+        chat_history_window=50,
+        blob_store_bytes=4 * 1024 * 1024,
+        session_ttl=24 * 3600,
+        session_lock_wait=10,
+    ):
+        """
+        Parameters:
+            chain_history_window (int): number of most recent chain executions kept in the agent context
+            chat_history_window (int): number of most recent chat messages kept in the agent context
+            blob_store_bytes (int): size cap of the store holding the session's code and outputs
+            session_ttl (float): seconds a session is kept after its last change
+            session_lock_wait (float): seconds a request waits for another request of the same session
+        """
+        self._lock = threading.RLock()
+        self._components = {}
+        self.chain_history_window = chain_history_window
+        self.chat_history_window = chat_history_window
+        self.blob_store_bytes = blob_store_bytes
+        self.session_ttl = session_ttl
+        self.session_lock_wait = session_lock_wait
+
+    @property
+    def is_ready(self):
+        return "chains" in self._components
+
+    def warm_up(self):
+        self.backend
+        self.evaluator
+        return self.chains
+
+    @lazy
+    def backend(self):
+        from state_backends import backend_from_url
+
+        return backend_from_url(self.env.get("STATE_BACKEND_URL"))
+
+    @lazy
+    def env(self):
+        import dotenv
+
+        dotenv.load_dotenv()
+        return os.environ
+
+    @lazy
+    def tenant_limiter(self):
+        from tenant_limits import TenantLimiter
+
+        return TenantLimiter(
+            self.backend,
+            max_concurrent_turns=int(self.env["TENANT_MAX_CONCURRENT_TURNS"])
+            if self.env.get("TENANT_MAX_CONCURRENT_TURNS") else None,
+            max_tokens_per_window=int(self.env["TENANT_MAX_TOKENS_PER_HOUR"])
+            if self.env.get("TENANT_MAX_TOKENS_PER_HOUR") else None,
+            window_seconds=3600,
+            turn_ttl=self.turn_timeout + 60,
         )
-        self.code_correction_system_prompt = toml.load(
-            "../agent/prompts/code_correction_prompt.toml"
-        )["system_message"]["prompt"]
-        self.code_correction_prompt_template = Template(
-            toml.load("../agent/prompts/code_correction_prompt.toml")["main_prompt"][
-                "prompt"
+
+    @property
+    def turn_timeout(self):
+        return float(self.env.get("TURN_TIMEOUT", 600))
+
+    @lazy
+    def llm(self):
+        from council.llm import AzureLLM
+        from council.llm.openai_llm import OpenAILLM
+        from llm_fallback import LLMFallback
+
+        self.env
+        llm = LLMFallback(OpenAILLM.from_env(), AzureLLM.from_env(), retry_before_fallback=1)
+        if float(self.env.get("LLM_CACHE_TTL") or 0) > 0:
+            from llm_cache import CachedLLM
+
+            llm = CachedLLM(
+                llm, self.backend, ttl=float(self.env["LLM_CACHE_TTL"]), namespace=self.env.get("OPENAI_LLM_MODEL", "")
+            )
+        return llm
+
+    @lazy
+    def prompts(self):
+        # Load prompts and prompt templates, parsing each file once
+        import toml
+
+        prompts = {
+            name: toml.load(f"{PROMPTS_DIR}/{name}.toml")
+            for name in [
+                "fred_data_specialist_prompts",
+                "description",
+                "code_editor_prompt",
+                "code_correction_prompt",
             ]
+        }
+        return {
+            "fred_system_prompt": prompts["fred_data_specialist_prompts"]["system_message"]["prompt"],
+            "fred_prompt_template": Template(prompts["fred_data_specialist_prompts"]["main_prompt"]["prompt"]),
+            "code_header": prompts["description"]["code_header"]["code"],
+            "code_editor_system_prompt": prompts["code_editor_prompt"]["system_message"]["prompt"],
+            "code_editor_prompt_template": Template(prompts["code_editor_prompt"]["main_prompt"]["prompt"]),
+            "code_correction_system_prompt": prompts["code_correction_prompt"]["system_message"]["prompt"],
+            "code_correction_prompt_template": Template(prompts["code_correction_prompt"]["main_prompt"]["prompt"]),
+        }
+
+    @lazy
+    def script_index(self):
+        """
+        Scripts that executed successfully, shared by all sessions, to reuse or show as references.
+        """
+        from script_index import ScriptIndex
+
+        path = self.env.get("SCRIPT_INDEX_PATH") or os.path.join(
+            os.path.expanduser("~"), ".cache", "council-fred-analyst", "script_index.jsonl"
         )
+        return ScriptIndex(path)
 
-    def init_skills(self):
+    @lazy
+    def fred_data_specialist(self):
         """
         FRED Data Specialist
         """
-        self.fred_data_specialist = FredDataSpecialist(
+        from skills import FredDataSpecialist
+
+        return FredDataSpecialist(
             self.llm,
-            system_prompt=self.fred_system_prompt,
-            main_prompt_template=self.fred_prompt_template,
-            code_header=self.code_header,
+            system_prompt=self.prompts["fred_system_prompt"],
+            main_prompt_template=self.prompts["fred_prompt_template"],
+            code_header=self.prompts["code_header"],
+            script_index=self.script_index,
         )
 
+    @lazy
+    def code_editing_skill(self):
         """
         Specialized Python code EDITING skill for daily securities price analysis.
         """
-        self.code_editing_skill = PythonCodeEditorSkill(
+        from skills import PythonCodeEditorSkill
+
+        return PythonCodeEditorSkill(
             self.llm,
-            system_prompt=self.code_editor_system_prompt,
-            editor_prompt_template=self.code_editor_prompt_template,
-            code_header=self.code_header,
+            system_prompt=self.prompts["code_editor_system_prompt"],
+            editor_prompt_template=self.prompts["code_editor_prompt_template"],
+            code_header=self.prompts["code_header"],
+            script_index=self.script_index,
         )
 
+    @lazy
+    def parse_python_skill(self):
         """
         Validate/parse Python code block - could easily be generalized to regex pattern matching skill.
         """
-        self.parse_python_skill = ParsePythonSkill()
+        from skills import ParsePythonSkill
+
+        return ParsePythonSkill()
+
+    @lazy
+    def prefetch_skill(self):
+        """
+        Warm the sandbox's FRED series cache with the series the parsed code uses, in the background.
+        """
+        from skills import PrefetchFredSeriesSkill
 
+        return PrefetchFredSeriesSkill(python_bin_dir=self.env['PYTHON_BIN_DIR'])
+
+    @lazy
+    def workspace_pool(self):
+        """
+        Per-session working directories of the sandboxed code, under SANDBOX_WORKSPACE_DIR (shared by the
+        workers of one host). Makes the sandbox's venv read-only.
+        """
+        import tempfile
+        from code_sandbox import WorkspacePool
+
+        root = self.env.get("SANDBOX_WORKSPACE_DIR") or os.path.join(
+            tempfile.gettempdir(), "council-fred-analyst", "workspaces"
+        )
+        return WorkspacePool(root, max_age=self.session_ttl, sandbox_path=self.env['PYTHON_BIN_DIR'])
+
+    @lazy
+    def python_execution_skill(self):
         """
         Execute Python code locally in host environment - UNSAFE.
         """
-        self.python_execution_skill = PythonExecutionSkill(
+        from skills import PythonExecutionSkill
+
+        return PythonExecutionSkill(
             self.llm,
-            system_prompt=self.code_correction_system_prompt,
-            error_correction_template=self.code_correction_prompt_template,
-            code_header=self.code_header,
-            python_bin_dir=os.environ['PYTHON_BIN_DIR']
+            system_prompt=self.prompts["code_correction_system_prompt"],
+            error_correction_template=self.prompts["code_correction_prompt_template"],
+            code_header=self.prompts["code_header"],
+            python_bin_dir=self.env['PYTHON_BIN_DIR'],
+            script_index=self.script_index,
+            workspace_pool=self.workspace_pool,
         )
 
+    @lazy
+    def general_skill(self):
         """
         A general skill for handling other things. This is LLMSkill customized with controller "iteration" support.
         """
-        self.general_skill = GeneralSkill(
+        from skills import GeneralSkill
+
+        return GeneralSkill(
             self.llm,
-            system_prompt="""You are a friendly, helpful assistant. 
+            system_prompt="""You are a friendly, helpful assistant.
             Generate a brief response according to the provided instruction; 2 sentences at most.""",
         )
 
-    def init_chains(self):
-        self.fred_data_specialist_chain = Chain(
+    @lazy
+    def fred_data_specialist_chain(self):
+        from council.chains import Chain
+
+        return Chain(
             name="fred_data_specialist",
             description="Identify and access economic datasets from the FRED database. Use this chain when you need to generate or edit code for accessing or downloading data from FRED.",
-            runners=[self.fred_data_specialist, self.parse_python_skill]
+            runners=[self.fred_data_specialist, self.parse_python_skill, self.prefetch_skill]
         )
 
-        self.code_editing_and_execution_chain = Chain(
+    @lazy
+    def code_editing_and_execution_chain(self):
+        from council.chains import Chain
+
+        return Chain(
             name="data_analysis_code_editing_and_execution",
             description="Generate/edit and execute existing Python code for data analytics and visualization. Use this chain if the user wants to generate new code or edit existing code related to data analysis.",
             runners=[
                 self.code_editing_skill,
                 self.parse_python_skill,
+                self.prefetch_skill,
                 self.python_execution_skill,
             ],
         )
 
-        self.code_editing_chain = Chain(
+    @lazy
+    def code_editing_chain(self):
+        from council.chains import Chain
+
+        return Chain(
             name="data_analysis_code_editing",
             description="Generate/edit (but do not execute) Python code for data analytics and visualization. Use this chain if the user wants to generate new code or edit existing code related to data analysis.",
             runners=[
                 self.code_editing_skill,
                 self.parse_python_skill,
+                self.prefetch_skill,
             ],
         )
 
-        self.code_execution_chain = Chain(
+    @lazy
+    def code_execution_chain(self):
+        from council.chains import Chain
+
+        return Chain(
             name="code_execution_and_correction",
             description="Execute (but do not edit) existing Python code for data analytics and visualization. Use this chain if the user wants to run existing code.",
             runners=[
                 self.parse_python_skill,
+                self.prefetch_skill,
                 self.python_execution_skill,
             ],
         )
 
-        self.general_chain = Chain(
+    @lazy
+    def general_chain(self):
+        from council.chains import Chain
+
+        return Chain(
             name="general",
             description="Answer general questions without the use of any specialized skills. Use this when the user needs the answer to a question that doesn't require any coding.",
             runners=[self.general_skill],
         )
 
-    def init_controller(self):
-        self.controller = LLMInstructController(
+    @lazy
+    def evaluator(self):
+        from evaluator import BasicEvaluatorWithSource
+
+        return BasicEvaluatorWithSource()
+
+    @lazy
+    def chains(self):
+        return [
+            self.fred_data_specialist_chain,
+            self.code_editing_chain,
+            self.code_editing_and_execution_chain,
+            self.code_execution_chain,
+            self.general_chain,
+        ]
+
+    @staticmethod
+    def _session_key(session_id):
+        return f"session:{session_id}"
+
+    def load_state(self, session_id):
+        """
+        The session's context, controller state (None for a new session) and blob store, as saved. Needs
+        neither the LLM nor the chains, so read-only requests do not build them.
+        """
+        from council.contexts import AgentContext, ChatHistory
+        from session_store import BlobStore, session_from_json
+
+        payload = self.backend.get(self._session_key(session_id))
+        if payload is not None:
+            try:
+                return session_from_json(payload.decode())
+            except (ValueError, KeyError, TypeError):
+                # E.g. a session saved by an older version: start it over rather than fail every request
+                logging.getLogger("council").warning(f"unreadable session {session_id}, starting a new one")
+        return AgentContext(chat_history=ChatHistory()), None, BlobStore(self.blob_store_bytes)
+
+    def load_session(self, session_id):
+        """The session's context and controller (new ones for an unknown session), with an agent to run them."""
+        from council.agents import Agent
+        from council_controller import LLMInstructController
+
+        context, state, blob_store = self.load_state(session_id)
+        controller = LLMInstructController(
             llm=self.llm,
             top_k_execution_plan=1,
+            blob_store=blob_store,
+            state=state,
+            run_data={"session_id": session_id},
         )
+        if state is None:
+            controller.set_state("code", None)
+        agent = Agent(controller=controller, chains=self.chains, evaluator=self.evaluator)
+        return Session(context, controller, agent)
 
-    def init_evaluator(self):
-        self.evaluator = BasicEvaluatorWithSource()
-
-    def init_agent(self):
-        self.agent = Agent(
-            controller=self.controller,
-            chains=[
-                self.fred_data_specialist_chain,
-                self.code_editing_chain,
-                self.code_editing_and_execution_chain,
-                self.code_execution_chain,
-                self.general_chain,
-            ],
-            evaluator=self.evaluator,
-        )
+    def save_session(self, session_id, session):
+        from session_store import session_to_json
+
+        payload = session_to_json(session.context, session.controller.state, session.controller.blob_store).encode()
+        self.backend.set(self._session_key(session_id), payload, ttl=self.session_ttl)
+        # The workspace lives as long as the session
+        self.workspace_pool.touch(session_id)
+
+    @contextmanager
+    def session(self, session_id, wait=None):
+        """
+        Load the session for a change, holding its lock so that no other worker changes it meanwhile, and
+        save it back unless the change fails.
+        """
+        from state_backends import LockTimeout
+
+        try:
+            with self.backend.lock(
+                f"{self._session_key(session_id)}:lock",
+                ttl=self.turn_timeout + 60,
+                wait=self.session_lock_wait if wait is None else wait,
+            ):
+                session = self.load_session(session_id)
+                yield session
+                self.save_session(session_id, session)
+        except LockTimeout:
+            raise SessionBusy("A previous request for this conversation is still running, please wait for it to finish.")
+
+    def reset(self, session_id=DEFAULT_SESSION):
+        """Start a new conversation. LLM clients, prompts, skills and chains are kept."""
+        self.backend.delete(self._session_key(session_id))
+        self.workspace_pool.release(session_id)
+
+    def publish_event(self, session_id, message):
+        """Make `message` the latest event of the session, as streamed to its clients by any worker."""
+        self.backend.set(f"{self._session_key(session_id)}:event", message.encode(), ttl=self.session_ttl)
+
+    def latest_event(self, session_id):
+        event = self.backend.get(f"{self._session_key(session_id)}:event")
+        return event.decode() if event is not None else None
+
+    def get_state(self, session_id, key):
+        from session_store import BlobStore
+
+        _, state, blob_store = self.load_state(session_id)
+        value = (state or {}).get(key)
+        return blob_store.get(value) if BlobStore.is_handle(value) else value
+
+    def set_state(self, session_id, key, value):
+        with self.session(session_id) as session:
+            session.controller.set_state(key, value)
+
+    def interact(
+        self, message, session_id=DEFAULT_SESSION, budget=None, max_tokens=None, profile=False, code=None, on_usage=None
+    ):
+        """
+        Run one turn of the conversation within `budget` seconds (default: TURN_TIMEOUT) and at most
+        `max_tokens` and TURN_MAX_TOKENS LLM tokens.
+        With `profile`, code executed during the turn is profiled (see `code_sandbox.run_code_in_sandbox`).
+        With `code`, the session's code is replaced by it first.
+        `on_usage` is called with the turn's usage once it ends, also if it fails (e.g. to charge its tokens).
+
+        Returns the agent's reply, the session's code and execution profile after the turn, and the
+        turn's usage.
+        """
+        from council.runners import RunnerTimeoutError
+        from budgeting import turn_budget, usage_report
+        from session_store import trim_agent_context
+
+        budget = budget if budget is not None else self.turn_timeout
+        token_limits = [max_tokens, int(self.env["TURN_MAX_TOKENS"]) if self.env.get("TURN_MAX_TOKENS") else None]
+        token_limits = [t for t in token_limits if t is not None]
+        turn = turn_budget(budget, min(token_limits) if token_limits else None)
 
-    def interact(self, message, budget=600):
         print(f"User Message: {message}")
-        self.context.chatHistory.add_user_message(message)
-        result = self.agent.execute(context=self.context, budget=Budget(budget))
-        last_message = result.messages[-1].message
-        self.context.chatHistory.add_agent_message(last_message.message)
+        session_token = current_session_id.set(session_id)
+        try:
+            with self.session(session_id) as session:
+                if code is not None:
+                    session.controller.set_state("code", code)
+                session.controller.set_state("profiling", profile)
+                session.context.chatHistory.add_user_message(message)
+                try:
+                    result = session.agent.execute(context=session.context, budget=turn)
+                    messages = result.messages
+                except RunnerTimeoutError:
+                    messages = []
+                # Once the budget is exhausted council drops skill results, leaving only the (unscored) chain instructions
+                if len(messages) > 0 and not (turn.is_expired() and messages[-1].score == 0):
+                    last_message = messages[-1].message.message
+                else:
+                    last_message = "Sorry, I could not complete this request within its time and token budget."
+                session.context.chatHistory.add_agent_message(last_message)
+
+                trim_agent_context(session.context, self.chain_history_window, self.chat_history_window)
+                logging.getLogger("council").debug(f"session memory: {self._memory_report(session)}")
+        finally:
+            current_session_id.reset(session_token)
+            usage = usage_report(turn)
+            logging.getLogger("council").info(f"turn usage: {usage}")
+            if on_usage is not None:
+                on_usage(usage)
+
+        return {
+            "message": last_message,
+            "code": session.controller.get_state("code"),
+            "profile": session.controller.get_state("profile"),
+            "usage": usage,
+        }
+
+    @staticmethod
+    def _memory_report(session):
+        from session_store import memory_report
+
+        return memory_report(session.context, session.controller.state, session.controller.blob_store)
+
+    def memory_report(self, session_id=DEFAULT_SESSION):
+        from session_store import memory_report
+
+        context, state, blob_store = self.load_state(session_id)
+        return memory_report(context, state or {}, blob_store)
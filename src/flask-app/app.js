@@ -13,10 +13,14 @@ document.addEventListener('DOMContentLoaded', function () {
     lineWrapping: true,
   });
 
+  // Each page load is a new conversation; any server worker can serve it
+  var sessionId = window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2);
+
   fetch('http://127.0.0.1:5000/reset', {
     method: 'POST',
     headers: {
-      'Content-Type': 'application/x-www-form-urlencoded'
+      'Content-Type': 'application/x-www-form-urlencoded',
+      'X-Session-Id': sessionId
     },
     body: ''
   })
@@ -57,6 +61,7 @@ document.addEventListener('DOMContentLoaded', function () {
     };
 
     xhr.open('GET', fileUrl, true);
+    xhr.setRequestHeader('X-Session-Id', sessionId);
     xhr.send();
   }
 
@@ -68,7 +73,8 @@ document.addEventListener('DOMContentLoaded', function () {
     fetch('http://127.0.0.1:5000/post_code', {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/x-www-form-urlencoded'
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-Session-Id': sessionId
       },
       body: 'code=' + encodeURIComponent(code)
     })
@@ -92,6 +98,7 @@ document.addEventListener('DOMContentLoaded', function () {
   var chatContainer = document.getElementById('chatContainer');
   var messageInput = document.getElementById('messageInput');
   var sendMessageButton = document.getElementById('sendMessageButton');
+  var profileCheckbox = document.getElementById('profileCheckbox');
 
   function addMessage(message, isUser) {
 
@@ -119,26 +126,9 @@ document.addEventListener('DOMContentLoaded', function () {
 
   function handleUserMessage() {
 
-    // Post the code in the editor to the server first
+    // The code in the editor is sent along with the message
     var code = editor.getValue(); // Assuming you have an initialized CodeMirror editor
 
-    fetch('http://127.0.0.1:5000/post_code', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/x-www-form-urlencoded'
-      },
-      body: 'code=' + encodeURIComponent(code)
-    })
-      .then(response => response.text())
-      .then(result => {
-        console.log('Code executed:', result);
-        // Handle the response/result as needed
-      })
-      .catch(error => {
-        console.error('Error executing code:', error);
-        // Handle the error
-      });
-
 
     var message = messageInput.value.trim();
     if (message !== '') {
@@ -149,15 +139,19 @@ document.addEventListener('DOMContentLoaded', function () {
       fetch('http://127.0.0.1:5000/handle_user_message', {
         method: 'POST',
         headers: {
-          'Content-Type': 'application/x-www-form-urlencoded'
+          'Content-Type': 'application/x-www-form-urlencoded',
+          'X-Session-Id': sessionId
         },
-        body: 'message=' + encodeURIComponent(message)
+        body: 'message=' + encodeURIComponent(message) + '&code=' + encodeURIComponent(code) + '&profile=' + profileCheckbox.checked
       })
         .then(response => response.json())
         .then(result => {
           // Handle the response from the server
           addMessage(result['message'], false); // Add the AI assistant's response to the chat interface
           logs_console.setValue(result['message'])
+          if (result['profile']) {
+            logs_console.setValue(JSON.stringify(result['profile'], null, 2))
+          }
           editor.setValue(result['code'])
           console.log(result['code'])
 
@@ -170,7 +164,7 @@ document.addEventListener('DOMContentLoaded', function () {
     }
   }
 
-  const logsSource = new EventSource('http://127.0.0.1:5000/latest_log_stream');
+  const logsSource = new EventSource('http://127.0.0.1:5000/latest_log_stream?session=' + sessionId);
 
   logsSource.onmessage = function (event) {
     // Update the UI with the latest log message
@@ -2,9 +2,11 @@ from flask import Flask, request, Response
 from flask_cors import CORS
 from subprocess import run
 import os
-from agent import AgentApp
+from agent import DEFAULT_SESSION, AgentApp, SessionBusy, current_session_id
+from tenant_limits import TenantLimitExceeded
 import traceback
 import logging
+import threading
 import time
 
 logging.basicConfig(
@@ -15,60 +17,93 @@ logging.basicConfig(
 
 app = Flask(__name__)
 CORS(app)
-agent_app = None
+
+# Cheap to construct: skills, chains and LLM clients are only built on first use (or by `warm_up`)
+agent_app = AgentApp()
 
 logger = logging.getLogger("council")
 logger.setLevel(logging.DEBUG)
 
 
-# Create the custom logging handler
-class MemoryHandler(logging.Handler):
-    def __init__(self):
-        super().__init__()
-        self.latest_log_message = None
-        self.latest_output = ""
-
+# Create the custom logging handler: controller messages become the latest event of the turn's session
+class SessionEventHandler(logging.Handler):
     def emit(self, record):
+        session_id = current_session_id.get()
+        if session_id is None:
+            return
         log_message = self.format(record)
         if "Controller Message" in log_message:
-            self.latest_log_message = log_message
-        if "agent execution ended" in log_message:
-            self.latest_log_message = self.latest_output
+            agent_app.publish_event(session_id, log_message)
+
+
+logger.addHandler(SessionEventHandler())
 
 
-memory_handler = MemoryHandler()
-logger.addHandler(memory_handler)
+def get_tenant():
+    """
+    Who the tenant limits apply to: the authenticated user, as set by the WSGI server or, in the TENANT_HEADER
+    header, by a trusted authenticating proxy; otherwise the client address. Identities sent by clients
+    themselves are not trusted.
+    """
+    header = agent_app.env.get("TENANT_HEADER")
+    user = request.remote_user or (request.headers.get(header) if header else None)
+    return f"user:{user}" if user else f"address:{request.remote_addr}"
+
+
+def get_session_id():
+    # EventSource cannot set headers, hence the query parameter
+    return request.headers.get("X-Session-Id") or request.args.get("session") or DEFAULT_SESSION
 
 
 # Route to get the latest log message as an SSE stream
 @app.route("/latest_log_stream")
 def get_latest_log_stream():
+    session_id = get_session_id()
+
     def generate_log_updates():
+        # Events come from the state backend, so the stream can be served by any worker
+        last_event, dots = None, ""
         while True:
-            memory_handler.latest_log_message
-            if memory_handler.latest_log_message:
-                if "Controller Message" in memory_handler.latest_log_message:
-                    memory_handler.latest_log_message += "."
-                yield f"data: {memory_handler.latest_log_message}\n\n"
+            event = agent_app.latest_event(session_id)
+            if event:
+                dots = dots + "." if event == last_event and "Controller Message" in event else ""
+                last_event = event
+                yield f"data: {event}{dots}\n\n"
+            else:
+                # A comment line: lets the server notice disconnected clients and free their thread
+                yield ": keep-alive\n\n"
             time.sleep(1)
 
     return Response(generate_log_updates(), content_type="text/event-stream")
 
 
+@app.route("/healthz")
+def healthz():
+    # Must not touch any lazy component of the agent
+    return {"status": "ok", "agent_ready": agent_app.is_ready}, 200
+
+
 @app.route("/get_code")
 def serve_code():
-    if "code" in agent_app.controller._state:
-        return agent_app.controller._state["code"], 200
+    code = agent_app.get_state(get_session_id(), "code")
+    if code:
+        return code, 200
     else:
         return "No code to display.", 200
 
 
+@app.route("/memory")
+def memory():
+    if not agent_app.is_ready:
+        return {}, 200
+    return agent_app.memory_report(get_session_id()), 200
+
+
 @app.route("/reset", methods=["POST"])
 def reset():
-    global agent_app
-    agent_app = AgentApp()
-    agent_app.controller._state["code"] = None
-    memory_handler.latest_log_message = "Ready."
+    session_id = get_session_id()
+    agent_app.reset(session_id)
+    agent_app.publish_event(session_id, "Ready.")
     return "Ready!", 200
 
 
@@ -76,9 +111,11 @@ def reset():
 def post_code():
     try:
         code = request.form.get("code")
-        agent_app.controller._state["code"] = code
+        agent_app.set_state(get_session_id(), "code", code)
         print("CODE POSTED")
         return "Code posted!", 200
+    except SessionBusy as e:
+        return str(e), 409
     except Exception as e:
         print("CODE NOT POSTED")
         print(e)
@@ -108,16 +145,45 @@ def post_code():
 def handle_user_message():
     try:
         message = request.form.get("message")
-        agent_app.interact(message)
-        agent_response = agent_app.context.chatHistory.last_agent_message.message
-        memory_handler.latest_output = agent_response
-        code = agent_app.controller._state["code"]
-        return {"message": agent_response, "code": code}, 200
+        profile = request.form.get("profile") == "true"
+        session_id = get_session_id()
+        tenant = get_tenant()
+        limiter = agent_app.tenant_limiter
+        with limiter.turn(tenant):
+            remaining_tokens = limiter.remaining_tokens(tenant)
+            # The editor's code comes with the message, so that it is part of the same change of the session.
+            # Tokens are charged even if the turn fails
+            result = agent_app.interact(
+                message,
+                session_id=session_id,
+                max_tokens=remaining_tokens,
+                profile=profile,
+                code=request.form.get("code"),
+                on_usage=lambda usage: limiter.record_tokens(tenant, usage["tokens"]),
+            )
+        agent_app.publish_event(session_id, result["message"])
+        return {
+            "message": result["message"],
+            "code": result["code"],
+            "usage": result["usage"],
+            "profile": result["profile"] if profile else None,
+        }, 200
+    except (TenantLimitExceeded, SessionBusy) as e:
+        return {"message": str(e), "code": request.form.get("code")}, 429
     except Exception as e:
         print(traceback.format_exc())
         return "Sorry, something went wrong!", 500
 
 
+# Behind reverse proxies (e.g. a load balancer), the client address is the one they add to X-Forwarded-For.
+# Read from the process environment: `.env` is only loaded once the agent is used, not at import
+if int(os.getenv("TRUSTED_PROXY_HOPS") or 0) > 0:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["TRUSTED_PROXY_HOPS"]))
+
+
 if __name__ == "__main__":
-    agent_app = AgentApp()
+    # Build the agent in the background so that the server (and /healthz) is up immediately
+    threading.Thread(target=agent_app.warm_up, name="agent-warm-up", daemon=True).start()
     app.run(debug=True, use_reloader=False, threaded=True)
@@ -0,0 +1,39 @@
+import hashlib
+import json
+
+from typing import List, Any
+
+from council.llm import LLMBase, LLMMessage, LLMResult
+
+
+class CachedLLM(LLMBase):
+    """
+    Cache of LLM responses in the app's state backend, shared by all workers, for `ttl` seconds.
+
+    Responses are keyed by `namespace` (e.g. the model) and the messages. A cached response consumes no
+    tokens, so it does not count against the budget of a turn.
+    """
+
+    _llm: LLMBase
+
+    def __init__(self, llm: LLMBase, backend, ttl: float, namespace: str = ""):
+        super().__init__()
+        self._llm = llm
+        self._backend = backend
+        self._ttl = ttl
+        self._namespace = namespace
+        self.accepts_deadline = getattr(llm, "accepts_deadline", False)
+
+    def _key(self, messages: List[LLMMessage]) -> str:
+        payload = json.dumps([self._namespace, [m.dict() for m in messages]])
+        return "llm:" + hashlib.sha256(payload.encode()).hexdigest()
+
+    def _post_chat_request(self, messages: List[LLMMessage], **kwargs: Any) -> LLMResult:
+        key = self._key(messages)
+        cached = self._backend.get(key)
+        if cached is not None:
+            return LLMResult(json.loads(cached))
+
+        result = self._llm.post_chat_request(messages, **kwargs)
+        self._backend.set(key, json.dumps(list(result.choices)).encode(), ttl=self._ttl)
+        return result
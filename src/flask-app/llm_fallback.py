@@ -1,6 +1,6 @@
 import time
 
-from typing import List, Any
+from typing import List, Any, Optional
 
 from council.llm import LLMBase, LLMMessage, LLMResult, LLMException
 
@@ -9,6 +9,10 @@ class LLMFallback(LLMBase):
     _llm: LLMBase
     _fallback: LLMBase
 
+    # `post_chat_request` takes an optional `deadline` (time.monotonic() value): retries and the fallback are
+    # skipped once they can no longer complete before it
+    accepts_deadline = True
+
     def __init__(self, llm: LLMBase, fallback: LLMBase, retry_before_fallback: int = 2):
         super().__init__()
         self._llm = llm
@@ -16,22 +20,26 @@ class LLMFallback(LLMBase):
         self._retry_before_fallback = retry_before_fallback
 
     def _post_chat_request(self, messages: List[LLMMessage], **kwargs: Any) -> LLMResult:
+        deadline = kwargs.pop("deadline", None)
         try:
-            return self._llm_call_with_retry(messages, **kwargs)
+            return self._llm_call_with_retry(messages, deadline, **kwargs)
         except LLMException as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise e
             try:
                 return self._fallback.post_chat_request(messages, **kwargs)
             except Exception:
                 raise e
 
-    def _llm_call_with_retry(self, messages: List[LLMMessage], **kwargs: Any) -> LLMResult:
+    def _llm_call_with_retry(self, messages: List[LLMMessage], deadline: Optional[float], **kwargs: Any) -> LLMResult:
         retry_count = 0
         while retry_count < self._retry_before_fallback:
             try:
                 return self._llm.post_chat_request(messages, **kwargs)
             except LLMException as e:
-                if "503" in str(e):
-                    time.sleep(1.25 ** retry_count)
+                delay = 1.25 ** retry_count
+                if "503" in str(e) and (deadline is None or time.monotonic() + delay < deadline):
+                    time.sleep(delay)
                     retry_count += 1
                 else:
                     raise e
@@ -0,0 +1,724 @@
+"""
+Record/replay load test of the Flask app. Run it from `src/flask-app`.
+
+Record browser sessions against the real app (real LLM and FRED), while using it from `index.html`:
+
+    python load_test.py serve --record sessions.jsonl
+
+Replay them against the app with a stubbed LLM (recorded responses, or canned ones for prompts that were
+not recorded) and a stubbed FRED API, at increasing numbers of concurrent users, and write a report:
+
+    python load_test.py run --sessions sessions.jsonl --concurrency 1,2,4,8 --duration 60 --report report.json
+
+Each virtual user replays one session after another, as `app.js` would: it opens the session's
+`/latest_log_stream` SSE connection and sends its requests, as fast as possible by default (see
+`--think-scale`). The report has, per concurrency level, throughput, latency percentiles per endpoint,
+SSE connection stats, and the resource usage of the server's process tree: threads, RSS, child processes
+(sandboxed code, FRED prefetches) and CPU cores used. Compare it with a baseline:
+
+    python load_test.py compare baseline.json report.json [--tolerance 0.15]
+
+Requests carry the headers `app.js` sends, so all virtual users come from one client address, like users
+behind one proxy. With `--tenant-header NAME`, each virtual user is a tenant of its own, as an authenticating
+proxy setting NAME would make it (the started server trusts NAME, see TENANT_HEADER).
+
+By default `run` starts the server itself (`serve`, Flask's threaded server). To test another setup, give
+`--server-command`, e.g. several gunicorn workers sharing a state backend:
+
+    python load_test.py run --server-command "gunicorn -w 4 --threads 8 -b 127.0.0.1:{port} 'load_test:create_load_test_app()'"
+
+`load_test_sessions.jsonl` is an example of recorded sessions, without recorded LLM responses.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import hashlib
+import http.client
+import json
+import os
+import platform
+import random
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+DEFAULT_SESSIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_test_sessions.jsonl")
+
+# Endpoints requested by `app.js`, recorded and replayed
+RECORDED_PATHS = ["/reset", "/post_code", "/get_code", "/handle_user_message", "/latest_log_stream"]
+SSE_PATH = "/latest_log_stream"
+
+# Canned responses of the stubbed LLM for prompts without a recorded response
+CANNED_CONTROLLER_DECISION = (
+    "data_analysis_code_editing_and_execution;9;Write and run code that compares the series the user asked about."
+)
+CANNED_GENERAL_RESPONSE = "Sure, happy to help with that."
+CANNED_CODE = """```python
+import os
+from fred_cache import Fred
+from fred_panel import get_panel
+
+fred = Fred(api_key=os.getenv("FRED_API_KEY"))
+panel = get_panel(fred, ["UNRATE", "CPIAUCSL", "FEDFUNDS"], freq="QS", how="mean")
+print(panel.pct_change().describe())
+print("Summarized the quarterly changes of UNRATE, CPIAUCSL and FEDFUNDS.")
+```"""
+
+
+def prompt_key(messages):
+    return hashlib.sha256(json.dumps([m.dict() for m in messages]).encode()).hexdigest()
+
+
+def estimated_tokens(messages, choices):
+    """Rough token count of a request and its response (about 4 characters per token)."""
+    return (sum(len(m.content) for m in messages) + sum(len(c) for c in choices)) // 4
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ---- Server side: the app, recording or stubbed ----
+
+
+def create_load_test_app():
+    """
+    The Flask app, set up by LOADTEST_* environment variables (see `serve`): recording sessions to
+    LOADTEST_RECORD, or with an LLM stub replaying the responses recorded in LOADTEST_SESSIONS.
+    """
+    from flask import request
+
+    import app as app_module
+    from council.llm import LLMBase, LLMResult
+    from council.runners import Consumption
+
+    agent_app = app_module.agent_app
+    record_path = os.getenv("LOADTEST_RECORD")
+
+    if record_path:
+        write_lock = threading.Lock()
+
+        def record(entry):
+            with write_lock, open(record_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+        class RecordingLLM(LLMBase):
+            def __init__(self, llm):
+                super().__init__()
+                self._llm = llm
+                self.accepts_deadline = getattr(llm, "accepts_deadline", False)
+
+            def _post_chat_request(self, messages, **kwargs):
+                start = time.monotonic()
+                result = self._llm.post_chat_request(messages, **kwargs)
+                record({
+                    "type": "llm",
+                    "prompt": prompt_key(messages),
+                    "choices": list(result.choices),
+                    "tokens": sum(c.value for c in result.consumptions if c.unit == "token"),
+                    "seconds": time.monotonic() - start,
+                })
+                return result
+
+        @app_module.app.before_request
+        def record_request():
+            if request.path in RECORDED_PATHS:
+                record({
+                    "type": "request",
+                    "session": app_module.get_session_id(),
+                    "time": time.time(),
+                    "method": request.method,
+                    "path": request.path,
+                    "form": request.form.to_dict(),
+                })
+
+        agent_app._components["llm"] = RecordingLLM(agent_app.llm)
+    else:
+        llm_records = [r for r in read_records(os.getenv("LOADTEST_SESSIONS", DEFAULT_SESSIONS)) if r["type"] == "llm"]
+        responses = {r["prompt"]: r for r in llm_records}
+        latency = float(os.getenv("LOADTEST_LLM_LATENCY", 1.0))
+        latency_scale = float(os.getenv("LOADTEST_LLM_LATENCY_SCALE", 1.0))
+        stats = defaultdict(int)
+
+        class ReplayLLM(LLMBase):
+            def _post_chat_request(self, messages, **kwargs):
+                recorded = responses.get(prompt_key(messages))
+                if recorded is not None:
+                    stats["replayed"] += 1
+                    time.sleep(recorded["seconds"] * latency_scale)
+                    return self.result(messages, recorded["choices"], recorded.get("tokens"))
+
+                stats["canned"] += 1
+                time.sleep(latency)
+                if "Controller Decision" in messages[-1].content:
+                    return self.result(messages, [CANNED_CONTROLLER_DECISION])
+                if "friendly, helpful assistant" in messages[0].content:
+                    return self.result(messages, [CANNED_GENERAL_RESPONSE])
+                return self.result(messages, [CANNED_CODE])
+
+            @staticmethod
+            def result(messages, choices, tokens=None):
+                # Consumptions like a real LLM's, so that token budgets, limits and usage reports take part
+                tokens = tokens if tokens is not None else estimated_tokens(messages, choices)
+                stats["tokens"] += tokens
+                return LLMResult(choices, [Consumption(tokens, "token", "load-test-stub")])
+
+        @app_module.app.route("/load_test/stats")
+        def load_test_stats():
+            return dict(stats), 200
+
+        agent_app._components["llm"] = ReplayLLM()
+
+    agent_app.warm_up()
+    return app_module.app
+
+
+class FredStubHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of the FRED API endpoints used by `fred_cache` and `fred_vintages`, with synthetic monthly
+    data (a random walk seeded by the series id) and two vintages per observation.
+    """
+
+    latency = 0.2
+
+    def log_message(self, *args):
+        pass
+
+    @staticmethod
+    def observations(series_id):
+        rng = random.Random(hashlib.sha1(series_id.encode()).hexdigest())
+        value = 100.0
+        today = datetime.date.today()
+        for year in range(1960, today.year + 1):
+            for month in range(1, 13):
+                date = datetime.date(year, month, 1)
+                if date >= today:
+                    return
+                value *= 1 + rng.gauss(0.002, 0.01)
+                yield date, value
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        series_id = query.get("series_id", "")
+        rows = []
+        if url.path.endswith("/series/observations") and "realtime_start" in query:
+            realtime_start = query["realtime_start"]
+            for date, value in self.observations(series_id):
+                first, revised = date + datetime.timedelta(days=35), date + datetime.timedelta(days=65)
+                vintages = [(first, revised - datetime.timedelta(days=1), value * 0.999), (revised, "9999-12-31", value)]
+                for released, ended, released_value in vintages:
+                    # Vintages valid on or after realtime_start, as FRED returns them
+                    if str(ended) >= realtime_start:
+                        rows.append(
+                            f'<observation realtime_start="{released}" realtime_end="{ended}" date="{date}" '
+                            f'value="{released_value:.4f}"/>'
+                        )
+            body = f"<observations>{''.join(rows)}</observations>"
+        elif url.path.endswith("/series/observations"):
+            rows = [f'<observation date="{d}" value="{v:.4f}"/>' for d, v in self.observations(series_id)]
+            body = f"<observations>{''.join(rows)}</observations>"
+        elif url.path.endswith("/series/vintagedates"):
+            dates = sorted({d + datetime.timedelta(days=days) for d, _ in self.observations(series_id) for days in (35, 65)})
+            body = f"<vintage_dates>{''.join(f'<vintage_date>{d}</vintage_date>' for d in dates)}</vintage_dates>"
+        else:
+            self.send_response(400)
+            self.end_headers()
+            self.wfile.write(b'<error code="400" message="Not supported by the FRED stub."/>')
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+
+# ---- Client side: virtual users ----
+
+
+def load_sessions(path):
+    """Requests of each recorded session, in order, with their offsets (seconds) from the session start."""
+    sessions = defaultdict(list)
+    for record in read_records(path):
+        if record["type"] == "request":
+            sessions[record["session"]].append(record)
+    for requests in sessions.values():
+        requests.sort(key=lambda r: r["time"])
+        for r in requests:
+            r["offset"] = r["time"] - requests[0]["time"]
+    return dict(sessions)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.status_counts = defaultdict(int)
+        self.sse_connections = 0
+        self.sse_failures = 0
+        self.sse_first_event = []
+        self.sse_events = 0
+        self.turn_tokens = []
+        self._lock = threading.Lock()
+
+    def add_request(self, path, status, seconds, body=b""):
+        with self._lock:
+            self.status_counts[str(status)] += 1
+            if isinstance(status, int) and status < 400:
+                self.latencies[path].append(seconds)
+                if path == "/handle_user_message":
+                    try:
+                        self.turn_tokens.append(json.loads(body)["usage"]["tokens"])
+                    except (ValueError, KeyError, TypeError):
+                        pass
+
+    def add_sse(self, connected, first_event, events):
+        with self._lock:
+            self.sse_connections += 1
+            self.sse_failures += 0 if connected else 1
+            if first_event is not None:
+                self.sse_first_event.append(first_event)
+            self.sse_events += events
+
+
+class SSEClient(threading.Thread):
+    """Reads a `/latest_log_stream` connection until closed, counting events."""
+
+    def __init__(self, host, port, session_id, stats):
+        super().__init__(daemon=True)
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+        self.session_id = session_id
+        self.stats = stats
+        self.closed = False
+
+    def run(self):
+        start, first_event, events, connected = time.monotonic(), None, 0, False
+        try:
+            self.connection.request("GET", f"{SSE_PATH}?{urlencode({'session': self.session_id})}")
+            response = self.connection.getresponse()
+            connected = response.status == 200
+            while connected and not self.closed:
+                line = response.fp.readline()
+                if not line:
+                    break
+                if line.startswith(b"data:"):
+                    events += 1
+                    if first_event is None:
+                        first_event = time.monotonic() - start
+        except (OSError, http.client.HTTPException):
+            pass
+        self.stats.add_sse(connected or self.closed, first_event, events)
+
+    def close(self):
+        self.closed = True
+        try:
+            self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        self.connection.close()
+
+
+def replay_session(host, port, requests, session_id, stats, think_scale, timeout, tenant_header=None, tenant=None):
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    # The headers `app.js` sends, plus the one an authenticating proxy would add, if asked for
+    headers = {"X-Session-Id": session_id, "Content-Type": "application/x-www-form-urlencoded"}
+    if tenant_header:
+        headers[tenant_header] = tenant
+    sse_clients = []
+    start = time.monotonic()
+    try:
+        for request in requests:
+            wait = request["offset"] * think_scale - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+            if request["path"] == SSE_PATH:
+                sse = SSEClient(host, port, session_id, stats)
+                sse.start()
+                sse_clients.append(sse)
+                continue
+
+            began, response_body = time.monotonic(), b""
+            try:
+                body = urlencode(request["form"]) if request["method"] == "POST" else None
+                connection.request(request["method"], request["path"], body=body, headers=headers)
+                response = connection.getresponse()
+                response_body = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=timeout)
+            stats.add_request(request["path"], status, time.monotonic() - began, response_body)
+    finally:
+        connection.close()
+        for sse in sse_clients:
+            sse.close()
+        for sse in sse_clients:
+            sse.join(timeout=5)
+
+
+# ---- Resource usage of the server's process tree ----
+
+
+def process_table():
+    """{pid: (ppid, threads, rss_bytes, cpu_seconds)} of all processes, from /proc (Linux) or psutil."""
+    table = {}
+    if os.path.isdir("/proc"):
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        ticks = os.sysconf("SC_CLK_TCK")
+        for pid in filter(str.isdigit, os.listdir("/proc")):
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            # Fields after the command name, see proc(5): utime, stime, cutime and cstime include reaped children
+            cpu_seconds = sum(int(v) for v in fields[11:15]) / ticks
+            table[int(pid)] = (int(fields[1]), int(fields[17]), int(fields[21]) * page_size, cpu_seconds)
+        return table
+
+    import psutil
+
+    for p in psutil.process_iter(["ppid", "num_threads", "memory_info", "cpu_times"]):
+        cpu = p.info["cpu_times"]
+        table[p.pid] = (
+            p.info["ppid"],
+            p.info["num_threads"] or 0,
+            p.info["memory_info"].rss if p.info["memory_info"] else 0,
+            cpu.user + cpu.system + cpu.children_user + cpu.children_system if cpu else 0.0,
+        )
+    return table
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        table = process_table()
+        children = defaultdict(list)
+        for pid, (ppid, *_) in table.items():
+            children[ppid].append(pid)
+        tree, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            if pid in table:
+                tree.append(pid)
+                pending += children[pid]
+        return {
+            "time": time.monotonic(),
+            "threads": sum(table[p][1] for p in tree),
+            "rss_bytes": sum(table[p][2] for p in tree),
+            "child_processes": len(tree) - 1,
+            "cpu_seconds": table[self.pid][3] if self.pid in table else 0.0,
+        }
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(self.sample())
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.samples.append(self.sample())
+
+    def summary(self):
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = last["time"] - first["time"]
+        return {
+            "max_threads": max(s["threads"] for s in self.samples),
+            "max_rss_mb": round(max(s["rss_bytes"] for s in self.samples) / 2**20, 1),
+            "max_child_processes": max(s["child_processes"] for s in self.samples),
+            "mean_cpu_cores": round((last["cpu_seconds"] - first["cpu_seconds"]) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+
+# ---- Load levels and report ----
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def latency_summary(seconds):
+    return {
+        "count": len(seconds),
+        "p50_ms": round(percentile(seconds, 0.5) * 1000, 1),
+        "p90_ms": round(percentile(seconds, 0.9) * 1000, 1),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 1),
+        "max_ms": round(max(seconds) * 1000, 1),
+    }
+
+
+def fetch_json(host, port, path):
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return json.loads(response.read()) if response.status == 200 else None
+    except (OSError, ValueError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+
+
+def run_level(host, port, sessions, concurrency, duration, think_scale, timeout, server_pid, tenant_header=None):
+    stats = Stats()
+    sampler = ResourceSampler(server_pid) if server_pid else None
+    stub_before = fetch_json(host, port, "/load_test/stats") or {}
+    names = sorted(sessions)
+    deadline = time.monotonic() + duration
+
+    def virtual_user(user):
+        n = 0
+        while time.monotonic() < deadline:
+            name = names[(user + n) % len(names)]
+            replay_session(
+                host, port, sessions[name], f"{name}~{user}.{n}", stats, think_scale, timeout,
+                tenant_header=tenant_header, tenant=f"load-test-user-{user}",
+            )
+            n += 1
+
+    if sampler:
+        sampler.start()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(virtual_user, range(concurrency)))
+    elapsed = time.monotonic() - start
+    if sampler:
+        sampler.stop()
+    stub_after = fetch_json(host, port, "/load_test/stats") or {}
+
+    requests = sum(stats.status_counts.values())
+    ok = sum(len(v) for v in stats.latencies.values())
+    return {
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 1),
+        "requests": requests,
+        "errors": requests - ok,
+        "error_rate": round((requests - ok) / requests, 4) if requests else 0.0,
+        "status_counts": dict(stats.status_counts),
+        "throughput_rps": round(ok / elapsed, 2),
+        "turns_per_second": round(len(stats.latencies["/handle_user_message"]) / elapsed, 3),
+        "tokens_per_turn": round(statistics.mean(stats.turn_tokens), 1) if stats.turn_tokens else None,
+        "latency": {path: latency_summary(v) for path, v in sorted(stats.latencies.items()) if v},
+        "sse": {
+            "connections": stats.sse_connections,
+            "failures": stats.sse_failures,
+            "events": stats.sse_events,
+            "first_event_p50_ms": round(statistics.median(stats.sse_first_event) * 1000, 1)
+            if stats.sse_first_event else None,
+        },
+        "resources": sampler.summary() if sampler else None,
+        "llm_stub": {k: v - stub_before.get(k, 0) for k, v in stub_after.items()},
+    }
+
+
+def print_levels(levels):
+    print(f"{'users':>5} {'req/s':>8} {'turns/s':>8} {'turn p50':>9} {'turn p90':>9} {'errors':>7} "
+          f"{'tok/turn':>9} {'threads':>8} {'rss MB':>8} {'children':>9} {'cores':>6}")
+    for level in levels:
+        turn = level["latency"].get("/handle_user_message", {})
+        resources = level["resources"] or {}
+        print(
+            f"{level['concurrency']:>5} {level['throughput_rps']:>8} {level['turns_per_second']:>8} "
+            f"{turn.get('p50_ms', '-'):>9} {turn.get('p90_ms', '-'):>9} {level['error_rate']:>7.1%} "
+            f"{level['tokens_per_turn'] or '-':>9} "
+            f"{resources.get('max_threads', '-'):>8} {resources.get('max_rss_mb', '-'):>8} "
+            f"{resources.get('max_child_processes', '-'):>9} {resources.get('mean_cpu_cores', '-'):>6}"
+        )
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(host, port, path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if fetch_json(host, port, path) is not None:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"http://{host}:{port}{path} did not come up within {timeout}s")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    host = "127.0.0.1"
+    sessions = load_sessions(args.sessions)
+    if not sessions:
+        sys.exit(f"No recorded sessions in {args.sessions}")
+
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    processes = []
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port, server_pid = url.hostname, url.port, args.server_pid
+        else:
+            fred_port, port = free_port(), free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, __file__, "fred-stub", "--port", str(fred_port), "--latency", str(args.fred_latency)]
+            ))
+            # Fresh caches and script index for every run, so that runs are comparable
+            env = os.environ | {
+                "LOADTEST_SESSIONS": os.path.abspath(args.sessions),
+                "LOADTEST_LLM_LATENCY": str(args.llm_latency),
+                "LOADTEST_LLM_LATENCY_SCALE": str(args.llm_latency_scale),
+                "FRED_API_URL": f"http://{host}:{fred_port}/fred",
+                "FRED_API_KEY": "stub",
+                "FRED_CACHE_DIR": os.path.join(workdir, "fred"),
+                "SCRIPT_INDEX_PATH": os.path.join(workdir, "script_index.jsonl"),
+                "SANDBOX_WORKSPACE_DIR": os.path.join(workdir, "workspaces"),
+            }
+            if args.tenant_header:
+                env["TENANT_HEADER"] = args.tenant_header
+            command = (
+                shlex.split(args.server_command.format(port=port)) if args.server_command
+                else [sys.executable, __file__, "serve", "--port", str(port)]
+            )
+            server = subprocess.Popen(command, env=env)
+            processes.append(server)
+            server_pid = server.pid
+        wait_for(host, port, "/healthz")
+
+        levels = []
+        for concurrency in args.concurrency:
+            print(f"{concurrency} concurrent users for {args.duration:.0f}s...", flush=True)
+            levels.append(run_level(
+                host, port, sessions, concurrency, args.duration, args.think_scale, args.timeout, server_pid,
+                tenant_header=args.tenant_header,
+            ))
+            time.sleep(args.pause)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "sessions": os.path.basename(args.sessions),
+            "server_command": args.server_command or ("external" if args.url else "serve"),
+            "duration_seconds": args.duration,
+            "think_scale": args.think_scale,
+            "llm_latency": args.llm_latency,
+            "fred_latency": args.fred_latency,
+            "tenant_header": args.tenant_header,
+        },
+        "levels": levels,
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print_levels(levels)
+    print(f"report written to {args.report}")
+
+
+def compare(args):
+    """Regressions of `current` against `baseline`, at the concurrency levels both have."""
+    with open(args.baseline) as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    with open(args.current) as f:
+        current = {level["concurrency"]: level for level in json.load(f)["levels"]}
+
+    regressions = []
+    for concurrency in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[concurrency], current[concurrency]
+        checks = [
+            ("throughput_rps", before["throughput_rps"], after["throughput_rps"], -1),
+            ("turn p90_ms", before["latency"].get("/handle_user_message", {}).get("p90_ms"),
+             after["latency"].get("/handle_user_message", {}).get("p90_ms"), 1),
+            ("max_rss_mb", (before["resources"] or {}).get("max_rss_mb"), (after["resources"] or {}).get("max_rss_mb"), 1),
+        ]
+        for name, old, new, worse in checks:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            flag = "REGRESSION" if change * worse > args.tolerance else ""
+            print(f"{concurrency:>5} users  {name:<15} {old:>10} -> {new:>10} ({change:+.1%}) {flag}")
+            if flag:
+                regressions.append((concurrency, name))
+        if after["error_rate"] > before["error_rate"] + args.tolerance / 10:
+            print(f"{concurrency:>5} users  error_rate      {before['error_rate']:>10} -> {after['error_rate']:>10} REGRESSION")
+            regressions.append((concurrency, "error_rate"))
+    sys.exit(1 if regressions else 0)
+
+
+def serve(args):
+    if args.record:
+        os.environ["LOADTEST_RECORD"] = os.path.abspath(args.record)
+    app = create_load_test_app()
+    app.run(host="127.0.0.1", port=args.port, threaded=True, use_reloader=False)
+
+
+def fred_stub(args):
+    FredStubHandler.latency = args.latency
+    ThreadingHTTPServer(("127.0.0.1", args.port), FredStubHandler).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="run the app, stubbed (default) or recording sessions")
+    serve_parser.add_argument("--port", type=int, default=5000)
+    serve_parser.add_argument("--record", help="append the sessions and LLM responses to this file")
+
+    stub_parser = commands.add_parser("fred-stub", help="run the FRED API stub")
+    stub_parser.add_argument("--port", type=int, required=True)
+    stub_parser.add_argument("--latency", type=float, default=0.2)
+
+    run_parser = commands.add_parser("run", help="replay sessions at several concurrency levels")
+    run_parser.add_argument("--sessions", default=DEFAULT_SESSIONS)
+    run_parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 2, 4, 8])
+    run_parser.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    run_parser.add_argument("--pause", type=float, default=2, help="seconds between concurrency levels")
+    run_parser.add_argument("--think-scale", type=float, default=0, help="scale of the recorded pauses between requests")
+    run_parser.add_argument("--timeout", type=float, default=900, help="seconds before a request is given up")
+    run_parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per canned LLM response")
+    run_parser.add_argument("--llm-latency-scale", type=float, default=1.0, help="scale of recorded LLM latencies")
+    run_parser.add_argument("--fred-latency", type=float, default=0.2, help="seconds per FRED stub response")
+    run_parser.add_argument("--server-command", help="command starting the stubbed app on {port}")
+    run_parser.add_argument("--url", help="load an already running (stubbed) app instead of starting one")
+    run_parser.add_argument("--server-pid", type=int, help="with --url, the server process to measure")
+    run_parser.add_argument("--tenant-header", help="send each virtual user's own tenant id in this header")
+    run_parser.add_argument("--report", default="load_test_report.json")
+
+    compare_parser = commands.add_parser("compare", help="compare a report with a baseline report")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.15, help="relative change flagged as regression")
+
+    args = parser.parse_args()
+    {"serve": serve, "fred-stub": fred_stub, "run": run, "compare": compare}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
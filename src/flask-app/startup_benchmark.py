@@ -0,0 +1,103 @@
+"""
+Startup benchmark for the Flask app.
+
+Imports `app` in fresh interpreters, times the import and the first `/healthz` response, and exits
+with a non-zero status if the median exceeds the budget or if a deferred (heavy) module was
+imported eagerly. Run it from `src/flask-app`:
+
+    python startup_benchmark.py [--runs 5] [--import-budget-ms 300] [--healthz-budget-ms 50]
+
+Budgets default to STARTUP_IMPORT_BUDGET_MS / STARTUP_HEALTHZ_BUDGET_MS when set.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported once the agent is actually used
+DEFERRED_MODULES = ["council", "openai", "toml", "dotenv", "skills", "council_controller"]
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+response = app.app.test_client().get("/healthz")
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "healthz_ms": (t2 - t1) * 1000,
+    "healthz_status": response.status_code,
+    "eager_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def run_probe():
+    execution = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE], capture_output=True, text=True
+    )
+    if execution.returncode != 0:
+        raise RuntimeError(f"startup probe failed:\n{execution.stderr}")
+    return json.loads(execution.stdout.strip().splitlines()[-1]), execution.stderr
+
+
+def slowest_imports(importtime_log, top=10):
+    # Lines look like "import time:  self [us] | cumulative | imported package", nested imports
+    # are indented by two spaces per level
+    rows = []
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("   ") and not name.startswith("     "):  # direct imports of top-level modules
+            rows.append((int(cumulative) / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--import-budget-ms", type=float, default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS", 300))
+    )
+    parser.add_argument(
+        "--healthz-budget-ms", type=float, default=float(os.getenv("STARTUP_HEALTHZ_BUDGET_MS", 50))
+    )
+    args = parser.parse_args()
+
+    results = []
+    importtime_log = ""
+    for _ in range(args.runs):
+        result, importtime_log = run_probe()
+        results.append(result)
+
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    healthz_ms = statistics.median(r["healthz_ms"] for r in results)
+    eager_modules = sorted({m for r in results for m in r["eager_modules"]})
+
+    print(f"import app:    {import_ms:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"GET /healthz:  {healthz_ms:8.1f} ms (budget {args.healthz_budget_ms:.0f} ms)")
+    print("slowest direct imports (last run):")
+    for cumulative_ms, name in slowest_imports(importtime_log):
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import took {import_ms:.1f} ms")
+    if healthz_ms > args.healthz_budget_ms:
+        failures.append(f"/healthz took {healthz_ms:.1f} ms")
+    if any(r["healthz_status"] != 200 for r in results):
+        failures.append("/healthz did not return 200")
+    if eager_modules:
+        failures.append(f"deferred modules imported at startup: {', '.join(eager_modules)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
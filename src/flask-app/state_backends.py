@@ -0,0 +1,254 @@
+"""
+Shared state for the Flask app: sessions, the latest event of each session, tenant counters and the LLM
+response cache. With a shared backend, any worker process can serve any request.
+
+`backend_from_url` picks the backend from STATE_BACKEND_URL:
+    (empty)                    in-process memory, for a single process (the default)
+    sqlite:///path/to/state.db a SQLite file, shared by the processes of one host
+    redis://host:6379/0        a Redis-compatible server, shared by several hosts (needs `pip install redis`)
+"""
+import abc
+from contextlib import contextmanager
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class StateBackend(abc.ABC):
+    """Key-value store of bytes, with expiry, counters and locks."""
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abc.abstractmethod
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        pass
+
+    @abc.abstractmethod
+    def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Set `key` only if it is not set yet; return whether it was set."""
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str, value: Optional[bytes] = None):
+        """Delete `key`; with `value`, only if it still holds that value."""
+        pass
+
+    @abc.abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Add `amount` to the integer at `key` (0 if unset), refresh its expiry, and return the new value."""
+        pass
+
+    @contextmanager
+    def lock(self, key: str, ttl: float, wait: float = 0):
+        """
+        Hold `key` as a lock for at most `ttl` seconds (so that a crashed worker does not hold it forever),
+        waiting up to `wait` seconds for it. Raises `LockTimeout` if it cannot be acquired in time.
+        """
+        token = uuid.uuid4().hex.encode()
+        deadline = time.monotonic() + wait
+        while not self.add(key, token, ttl=ttl):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"{key} is held by another request")
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            self.delete(key, token)
+
+
+class MemoryBackend(StateBackend):
+    """In-process backend: only shared by the threads of one process."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _live(self, key):
+        item = self._items.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._items[key]
+            return None
+        return item
+
+    def _put(self, key, value, ttl):
+        self._items[key] = (value, time.time() + ttl if ttl is not None else None)
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            for k in list(self._items):
+                self._live(k)
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item is not None else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._put(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def delete(self, key, value=None):
+        with self._lock:
+            item = self._live(key)
+            if item is not None and (value is None or item[0] == value):
+                del self._items[key]
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            item = self._live(key)
+            count = int(item[0]) + amount if item is not None else amount
+            self._put(key, str(count).encode(), ttl)
+            return count
+
+
+class SQLiteBackend(StateBackend):
+    """Backend in a SQLite file, shared by all the processes (and threads) that open it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+
+    @property
+    def _db(self):
+        # sqlite3 connections must not be shared between threads
+        if getattr(self._local, "db", None) is None:
+            import sqlite3
+
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return self._local.db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db
+        # IMMEDIATE takes the write lock up front, so read-modify-write sequences are atomic across processes
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _expires_at(ttl):
+        return time.time() + ttl if ttl is not None else None
+
+    @staticmethod
+    def _select(db, key):
+        row = db.execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, key):
+        return self._select(self._db, key)
+
+    def set(self, key, value, ttl=None):
+        with self._transaction() as db:
+            db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, self._expires_at(ttl)))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def add(self, key, value, ttl=None):
+        with self._transaction() as db:
+            if self._select(db, key) is not None:
+                return False
+            db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, value, self._expires_at(ttl)))
+            return True
+
+    def delete(self, key, value=None):
+        with self._transaction() as db:
+            if value is None:
+                db.execute("DELETE FROM kv WHERE key = ?", (key,))
+            else:
+                db.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, value))
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._transaction() as db:
+            value = self._select(db, key)
+            count = int(value) + amount if value is not None else amount
+            db.execute("INSERT OR REPLACE INTO kv VALUES (?, ?, ?)", (key, str(count).encode(), self._expires_at(ttl)))
+            return count
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend on a Redis-compatible server. Only plain commands and WATCH/MULTI transactions are used (no
+    Lua scripts), so a local stand-in client can be passed as `client` instead.
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    @staticmethod
+    def _px(ttl):
+        return int(ttl * 1000) if ttl is not None else None
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=self._px(ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, px=self._px(ttl), nx=True))
+
+    def delete(self, key, value=None):
+        if value is None:
+            self.client.delete(key)
+            return
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) == value:
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+            except Exception as e:
+                # The key changed in the meantime: it is no longer ours to delete. Matched by name, as the
+                # client may be a stand-in with its own WatchError rather than the redis package's
+                if type(e).__name__ != "WatchError":
+                    raise
+
+    def incr(self, key, amount=1, ttl=None):
+        with self.client.pipeline() as pipe:
+            pipe.incrby(key, amount)
+            if ttl is not None:
+                pipe.pexpire(key, self._px(ttl))
+            return int(pipe.execute()[0])
+
+
+def backend_from_url(url: Optional[str]) -> StateBackend:
+    if not url or url == "memory://":
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
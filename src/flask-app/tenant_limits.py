@@ -0,0 +1,68 @@
+from contextlib import contextmanager
+import time
+
+
+class TenantLimitExceeded(Exception):
+    pass
+
+
+class TenantLimiter:
+    """
+    Per-tenant limits on concurrent agent turns and on LLM tokens over a rolling window, so that a single
+    conversation cannot monopolize the server's workers.
+
+    Counters live in the app's state backend, so the limits hold across worker processes. Tokens are
+    counted in `buckets` time buckets per window, which makes the window roll in steps of window/buckets.
+    """
+
+    def __init__(self, backend, max_concurrent_turns=None, max_tokens_per_window=None, window_seconds=3600,
+                 buckets=12, turn_ttl=3600):
+        """
+        Parameters:
+            backend (StateBackend): where the counters are kept
+            max_concurrent_turns (int): turns a tenant can run at once (None: no limit, the turns of one
+                session are serialized anyway)
+            max_tokens_per_window (int): LLM tokens a tenant can use per window (None: no limit)
+            turn_ttl (float): how long a turn counts as running if its worker dies before ending it
+        """
+        self.backend = backend
+        self.max_concurrent_turns = max_concurrent_turns
+        self.max_tokens_per_window = max_tokens_per_window
+        self.window_seconds = window_seconds
+        self.bucket_seconds = window_seconds / buckets
+        self.buckets = buckets
+        self.turn_ttl = turn_ttl
+
+    def _bucket_keys(self, tenant):
+        current = int(time.time() // self.bucket_seconds)
+        return [f"tenant:{tenant}:tokens:{bucket}" for bucket in range(current - self.buckets + 1, current + 1)]
+
+    def _tokens_used(self, tenant):
+        return sum(int(self.backend.get(key) or 0) for key in self._bucket_keys(tenant))
+
+    def remaining_tokens(self, tenant):
+        if self.max_tokens_per_window is None:
+            return None
+        return max(self.max_tokens_per_window - self._tokens_used(tenant), 0)
+
+    def record_tokens(self, tenant, tokens):
+        if tokens:
+            self.backend.incr(
+                self._bucket_keys(tenant)[-1], int(tokens), ttl=self.window_seconds + self.bucket_seconds
+            )
+
+    @contextmanager
+    def turn(self, tenant):
+        if self.max_tokens_per_window is not None and self._tokens_used(tenant) >= self.max_tokens_per_window:
+            raise TenantLimitExceeded("The token quota for this period is used up, please try again later.")
+        if self.max_concurrent_turns is None:
+            yield
+            return
+        active_key = f"tenant:{tenant}:active_turns"
+        if self.backend.incr(active_key, 1, ttl=self.turn_ttl) > self.max_concurrent_turns:
+            self.backend.incr(active_key, -1, ttl=self.turn_ttl)
+            raise TenantLimitExceeded("A previous request is still running, please wait for it to finish.")
+        try:
+            yield
+        finally:
+            self.backend.incr(active_key, -1, ttl=self.turn_ttl)